@@ -1,7 +1,10 @@
-import pickle
+import os
 import re
 import sys
-from numbers import Real
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
 from pathlib import Path
 
 import matplotlib as mpl
@@ -11,8 +14,10 @@ import numpy as np
 import pandas as pd
 from networkx.drawing.nx_pydot import pydot_layout, to_pydot
 
+from analysis.meso.control_flow.flowchart.graph_store import GraphStore
 from analysis.meso.control_flow.flowchart.metrics import Metrics
 from analysis.meso.control_flow.flowchart.utils import Node, NodeList
+from preprocessing.dataset import TokenDatasetIndex, index_path
 
 
 
@@ -96,13 +101,12 @@ def get_output_file_names(file_df:pd.DataFrame, output_dir:Path) -> tuple[Path,
     file_name = file_df["name"].to_numpy()[0]
 
     plot_path = output_dir / "plots" / f"{file_name}.png"
-    graph_path = output_dir / "pickle" / f"{file_name}.pkl"
+    graph_dir = output_dir / "graphs"  # the graph, node & edge tables of all graphs, see GraphStore
     metric_path = output_dir / "metrics.xlsx"
 
     plot_path.parent.mkdir(exist_ok=True)
-    graph_path.parent.mkdir(exist_ok=True)
 
-    return plot_path, graph_path, metric_path
+    return plot_path, graph_dir, metric_path
 
 
 
@@ -122,6 +126,13 @@ class ControlFlowGraph:
         self.file_lines = self.df["line"].unique()
         self.start_line = int(self.df.iloc[0]["line"])
 
+        # the token following each token in the same line, empty at the end of a line
+        lines = self.df["line"].to_numpy()
+        tokens = self.df["token"].to_numpy(dtype=object)
+        self.next_tokens = np.append(np.where(lines[1:] == lines[:-1], tokens[1:], ""), "")
+        # whether an IF appears in the line of each token up to and including the token, a running max per line
+        self.if_seen = pd.Series(tokens == "IF").groupby(lines, sort=False).cummax().to_numpy()
+
         self.nodes = NodeList()
         self.node_to_append_later = set()
         self.subroutine_nodes = []
@@ -150,13 +161,19 @@ class ControlFlowGraph:
 
         self._create_nodedf()
 
-        for idx, row in self.nodedf.iterrows():
+        # the line of every node row sorted, the first node row of a jump target is found by a binary search
+        records = self.nodedf.to_dict("records")
+        node_lines = self.nodedf["line"].to_numpy()
+        order = np.argsort(node_lines, kind="stable")
+        sorted_lines = node_lines[order]
+
+        for idx, row in zip(self.nodedf.index.tolist(), records, strict=True):
 
             line_jumps = self._get_line_jumps(row, idx)
 
             node_prefix = get_prefix(row)
             name = f"{node_prefix}_{row['line']}"
-            attr = row.to_dict() | {"line_jumps": line_jumps}
+            attr = row | {"line_jumps": line_jumps}
 
             node = Node(name, **attr)
             if node.subroutine and not (node.conditional or node.terminal):
@@ -172,8 +189,9 @@ class ControlFlowGraph:
                 self.nodes.append(node)
 
             for line_j in line_jumps:
-                line_j_row = self.nodedf[self.nodedf["line"] == line_j]
-                if line_j_row.empty or self._is_plain_subroutine(line_j_row):
+                pos = np.searchsorted(sorted_lines, line_j)
+                line_j_row = records[order[pos]] if pos < len(sorted_lines) and sorted_lines[pos] == line_j else None
+                if line_j_row is None or self._is_plain_subroutine(line_j_row):
                     # the statement does not jump to an existing node, create it later because in between two existing nodes can be created another node later
                     node_prefix = "S" if attr["subroutine"] else "M"
                     name = f"{node_prefix}_{line_j}"
@@ -201,10 +219,13 @@ class ControlFlowGraph:
         self.nodedf = self.nodedf.drop(columns=["file_id", "game_id", "name", "token_id", "bytes", "syntax", "language"])
 
         self.nodedf["subroutine"] = (self.nodedf["token"].isin({"GOSUB", "RETURN"}))
-        self.nodedf["conditional"] = self.nodedf.apply(self._is_conditional, axis=1)
+        self.nodedf["conditional"] = self._is_conditional(self.nodedf)
         self.nodedf["terminal"] = self.nodedf["token"].isin(terminal_cf)
 
         self.nodedf = self.nodedf[["line", "token", "conditional", "subroutine", "terminal"]]
+
+        # the positions of the node rows of each line, the other line jump statements of a line are looked up in it
+        self.line_nodes = self.nodedf.groupby("line", sort=False).indices
         return None
     
 
@@ -229,10 +250,13 @@ class ControlFlowGraph:
     
 
     def _add_load_nodes(self) -> None:
-        for node in self.nodes.nodes:
+        for node in self.nodes:
             if node.prefix == "L":
                 # LOAD node is unconnected, needs to be connected with the next node
-                next_node = (self.nodes > node)[0]
+                next_node = self.nodes.first_after(node.line)
+                if next_node is None:
+                    msg = f"no node after the LOAD node {node.name}"
+                    raise IndexError(msg)
                 node.line_jumps.append(next_node.line)
                 self.nodes.add_line_jumps(node)
         return None
@@ -245,7 +269,10 @@ class ControlFlowGraph:
                 # sometimes a node is present twice as main and subroutine...
                 pass
 
-            last_node = (self.nodes <= node)[-1] # comparison operator return a list of matching nodes based on node.line
+            last_node = self.nodes.last_before(node.line, inclusive=True)
+            if last_node is None:
+                msg = f"no node before the subroutine node {node.name}"
+                raise IndexError(msg)
             last_node.line_jumps = node.line_jumps + last_node.line_jumps
             self.nodes.add_line_jumps(last_node)
         return None
@@ -257,10 +284,10 @@ class ControlFlowGraph:
         for node in node_to_append_later:
 
             # next_nodes = self.nodedf[(self.nodedf["line"] > node.line) & (self.nodedf["token"] != "GOSUB")]
-            next_nodes = (self.nodes >= node)
+            next_node = self.nodes.first_after(node.line, inclusive=True)
 
-            if next_nodes:
-                node.line_jumps.append(next_nodes[0].line)
+            if next_node is not None:
+                node.line_jumps.append(next_node.line)
 
             if node not in self.nodes:
                 self.nodes.append(node)
@@ -333,20 +360,16 @@ class ControlFlowGraph:
         return None
 
 
-    def _is_conditional(self, row:pd.Series) -> bool:
-        if row["token"] == "THEN":
-            return True
-        
-        line_df = self.df[(self.df["line"] == row["line"]) & (self.df.index <= row.name)]
+    def _is_conditional(self, rows:pd.DataFrame) -> np.ndarray:
+        """Check for each row if it is a THEN or preceded by an IF in its line."""
 
         # possible conditionals are IF cond THEN JUMP_EXPRESSION xxx, IF cond THEN expression : JUMP_EXPRESSION xxx, IF cond JUMP_EXPRESSION xxx
-        return (line_df["token"] == "IF").any()
+        return (rows["token"] == "THEN").to_numpy() | self.if_seen[rows.index.to_numpy()]
     
 
-    def _is_plain_subroutine(self, rows:pd.DataFrame) -> bool:
+    def _is_plain_subroutine(self, row:dict) -> bool:
         """Check if a line jump is done to a plain GOSUB statement line."""
 
-        row = rows.iloc[0]
         return row["subroutine"] and not (row["terminal"] or row["conditional"])
     
 
@@ -356,22 +379,15 @@ class ControlFlowGraph:
         return row["subroutine"] and row["terminal"]
     
 
-    def _peek_next_line_token(self, idx:Real, row:pd.Series) -> str:
-
-        if len(self.df) <= idx+1:
-            return ""
-        
-        next_row = self.df.iloc[idx+1]
-        next_line = int(next_row["line"])
-
-        next_token = "" if next_line != row["line"] else next_row["token"]
-        return next_token
+    def _peek_next_line_token(self, idx:int) -> str:
+        """Return the token after the token at idx if it is in the same line, an empty string otherwise."""
+        return self.next_tokens[idx]
     
 
-    def _get_line_jumps(self, row:pd.Series, idx:Real) -> list[int]:
+    def _get_line_jumps(self, row:dict, idx:int) -> list[int]:
         line_jumps = []
 
-        next_token = self._peek_next_line_token(idx, row)
+        next_token = self._peek_next_line_token(idx)
 
         match row["token"]:
             case "RUN":
@@ -422,7 +438,7 @@ class ControlFlowGraph:
         return line_jumps
 
 
-    def _get_gosub_linejumps(self, row:pd.Series, idx:Real, next_token:str) -> list[int]:
+    def _get_gosub_linejumps(self, row:dict, idx:int, next_token:str) -> list[int]:
         line_jumps = []
         while next_token:
             if next_token.isdigit():
@@ -432,79 +448,131 @@ class ControlFlowGraph:
                 break
 
             idx += 1
-            next_token = self._peek_next_line_token(idx, row)
+            next_token = self._peek_next_line_token(idx)
 
         return line_jumps
     
 
-    def _line_jump_in_same_line(self, row:pd.Series, idx:int) -> bool:
+    def _line_jump_in_same_line(self, row:dict, idx:int) -> bool:
 
-        # a df with all line jump statements appearing in the same row after the current line jump statement
-        following = self.nodedf[(self.nodedf["line"] == row["line"]) & (self.nodedf.index > idx)]
-        preceding = self.nodedf[(self.nodedf["line"] == row["line"]) & (self.nodedf.index < idx)]
+        # all line jump statements appearing in the same row after the current line jump statement. The check is
+        # about the other line jump statements of the line, not its IF, so it does not read self.if_seen
+        positions = self.line_nodes[row["line"]]
+        node_idx = self.nodedf.index.to_numpy()[positions]
+        following = self.nodedf["token"].to_numpy()[positions][node_idx > idx]
 
         # either there are no other line jump cmds in the line or there is a previous line jump cmd in the row
-        same_line_line_jumps = not following.empty and preceding.empty
+        same_line_line_jumps = len(following) > 0 and not (node_idx < idx).any()
 
         # if all line jumps are subroutine, the next line will be reached nevertheless
-        return same_line_line_jumps and not (following["token"] == "GOSUB").all()
-    
+        return same_line_line_jumps and not (following == "GOSUB").all()
 
-    def save_graph(self, path:str|Path) -> None:
-        with Path(path).open("wb") as file:
-            pickle.dump(self.G, file)
-        return None
-    
 
 
-if __name__ == "__main__":
-    # problems: star-wars2: duplicate filenames but create duplicate graphs...
+def build_game_graphs(file_dfs:list[pd.DataFrame], output_dir:Path, create_plots:bool = False, calculate_metrics:bool = True) -> tuple[list[nx.DiGraph], dict | None]:
+    """Build the CFGs of the files of one game and calculate the metrics of the game.
 
-    path = "/Users/julian/Documents/3 - Bildung/31 - Studium/314 Universität Stuttgart/314.2 Semester 2/Projektarbeit/corpus/dataset/tokenized_dataset.parquet"
-    output_dir = Path("analysis/meso/control_flow/flowchart")
-    
-    CREATE_NEW_PLOTS = False
-    CALCULATE_METRICS = True
+    This is the worker function of the process pool, games do not depend on each other.
 
-    df = pd.read_parquet(path)
+    Args:
+        file_dfs (list[pd.DataFrame]): The token table of each file of the game.
+        output_dir (Path): The directory of the plots.
+        create_plots (bool): Write a plot of each graph.
+        calculate_metrics (bool): Calculate the metrics of the game.
+
+    Returns:
+        tuple[list[nx.DiGraph], dict | None]: The graph of each file and the metrics row of the game, None if the metrics are not calculated.
+    """
 
     cfg = ControlFlowGraph()
+    game_graphs = []
+    line_count = 0
+
+    for file_df in file_dfs:
+        file_df = file_df.drop_duplicates() # why are there duplicates?
+        plot_path, _, _ = get_output_file_names(file_df, output_dir)
+
+        graph = cfg.create_graph(file_df)
+
+        if create_plots:
+            write_graph(graph, plot_path)
+
+        game_graphs.append(graph)
+        line_count += len(cfg.file_lines)
+
+    if not calculate_metrics:
+        return game_graphs, None
+
+    # the game_id and name of the metrics are taken from the first row of the game, which is the first row of its first file
     metrics = Metrics()
+    metrics.calculate(game_graphs, line_count, file_dfs[0])
+    return game_graphs, metrics.metrics
 
 
-    for game_id in df["game_id"].unique():
-        game_df: pd.DataFrame = df[df["game_id"] == game_id]
-        game_graphs = []
-        line_count = 0
+def build_games(df:pd.DataFrame, index:TokenDatasetIndex, output_dir:Path, jobs:int = 1, create_plots:bool = False, 
+                calculate_metrics:bool = True) -> Iterator[tuple[int, list[nx.DiGraph], dict | None]]:
+    """Build the CFGs and metrics of all games in a process pool and yield them in the order of the index.
 
-        # if game_df["name"].str.contains("spukhaus").any():
-        #     # cyclomatic complexity takes too long
-        #     continue
+    Programs without metadata belong to no game and are skipped.
+    """
 
+    game_ids = [game_id for game_id in index.games() if game_id is not None]
+    # the rows of a game and of its files are slices of the sorted dataset, no need to scan the columns
+    file_dfs = ([df.iloc[entry.rows] for entry in index.files(game_id)] for game_id in game_ids)
 
-        for file in game_df["file_id"].unique():
-            file_df: pd.DataFrame = game_df[game_df["file_id"] == file]
+    with ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext() as executor:
+        map_func = executor.map if executor else map
+        results = map_func(build_game_graphs, file_dfs, repeat(output_dir), repeat(create_plots), repeat(calculate_metrics))
+        for game_id, (game_graphs, metrics_row) in zip(game_ids, results, strict=True):
+            yield game_id, game_graphs, metrics_row
 
-            file_df = file_df.drop_duplicates() # why are there duplicates?
-            plot_path, graph_path, metric_path = get_output_file_names(file_df, output_dir)
-            print(plot_path.stem)
+    return None
 
 
-            graph = cfg.create_graph(file_df)
+if __name__ == "__main__":
+    # problems: star-wars2: duplicate filenames but create duplicate graphs...
 
-            if CREATE_NEW_PLOTS:
-                write_graph(graph, plot_path)
-                cfg.save_graph(graph_path)
-                        
+    path = "/Users/julian/Documents/3 - Bildung/31 - Studium/314 Universität Stuttgart/314.2 Semester 2/Projektarbeit/corpus/dataset/tokenized_dataset.parquet"
+    output_dir = Path("analysis/meso/control_flow/flowchart")
+    
+    CREATE_NEW_PLOTS = False
+    CALCULATE_METRICS = True
+    SAVE_GRAPHS = False
+    JOBS = os.cpu_count()  # games are built in parallel, 1 builds them one after another
+
+    df = pd.read_parquet(path)
+    if index_path(path).is_file():
+        index = TokenDatasetIndex.read(path)
+    else:
+        # an older dataset without the sidecar index
+        df = df.sort_values(["game_id", "file_id"], kind="stable", ignore_index=True)
+        index = TokenDatasetIndex.from_dataframe(df)
 
-            game_graphs.append(graph)
-            line_count += len(cfg.file_lines)
+    metrics = Metrics()
+    metric_path = output_dir / "metrics.xlsx"
+    graph_dir = output_dir / "graphs"
+    graph_store = GraphStore()
+
+    # if game_df["name"].str.contains("spukhaus").any():
+    #     # cyclomatic complexity takes too long
+    #     continue
+
+    for game_id, game_graphs, metrics_row in build_games(df, index, output_dir, JOBS, CREATE_NEW_PLOTS, CALCULATE_METRICS):
+        for entry, graph in zip(index.files(game_id), game_graphs, strict=True):
+            print(entry.name)
+            if SAVE_GRAPHS:
+                graph_store.add(graph, entry.file_id, entry.game_id, entry.name)
 
         if CALCULATE_METRICS:
-            metrics.calculate(game_graphs, line_count, game_df)
+            metrics.add_metrics(metrics_row)
             # metrics.print_metrics()
 
 
+    if SAVE_GRAPHS:
+        # all graphs in one graph, node and edge table, GraphStore.read loads them back
+        graph_store.write(graph_dir)
+        print(graph_store, graph_dir)
+
     if CALCULATE_METRICS:
         metrics.save_df(metric_path)
         print(metric_path)
@@ -0,0 +1,230 @@
+"""The script provides a columnar store of the control flow graphs of the corpus, one node and one edge table."""
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Self
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+if TYPE_CHECKING:
+    from scipy.sparse import csr_array
+
+
+GRAPHS_FILE = "graphs.parquet"
+NODES_FILE = "nodes.parquet"
+EDGES_FILE = "edges.parquet"
+
+NODE_ATTRIBUTES = ["prefix", "line", "line_jumps", "token", "conditional", "subroutine", "terminal"]
+
+# one row per graph, its nodes & edges are the next `nodes` and `edges` rows of the node & edge tables
+GRAPH_SCHEMA = pa.schema([
+    pa.field("file_id", pa.int64(), nullable=False),
+    ("game_id", pa.int64()),
+    ("name", pa.dictionary(pa.int32(), pa.string())),  # the program name
+    ("nodes", pa.int64()),
+    ("edges", pa.int64()),
+])
+
+# one row per node, the nodes of a graph are stored one after another in the order of the graph
+NODE_SCHEMA = pa.schema([
+    ("file_id", pa.int64()),
+    ("node", pa.string()),
+    ("prefix", pa.dictionary(pa.int32(), pa.string())),
+    ("line", pa.int64()),
+    ("line_jumps", pa.list_(pa.int64())),
+    ("token", pa.dictionary(pa.int32(), pa.string())),
+    ("conditional", pa.bool_()),
+    ("subroutine", pa.bool_()),
+    ("terminal", pa.bool_()),
+])
+
+# one row per edge, source & target are the positions of the nodes within their graph
+EDGE_SCHEMA = pa.schema([
+    ("file_id", pa.int64()),
+    ("source", pa.int32()),
+    ("target", pa.int32()),
+])
+
+TABLES = ((GRAPHS_FILE, GRAPH_SCHEMA), (NODES_FILE, NODE_SCHEMA), (EDGES_FILE, EDGE_SCHEMA))
+
+
+class GraphStore:
+    """A class that stores the control flow graphs of many programs as a graph, a node and an edge table.
+
+    The tables are written as Parquet files, so all graphs of the corpus are loaded with one read of each file.
+    A graph is rebuilt as a networkx or a sparse graph only when it is requested, with its nodes, attributes and
+    edges in the order of the graph that was added.
+    """
+
+    def __init__(
+        self, graphs: pd.DataFrame | None = None, nodes: pd.DataFrame | None = None, edges: pd.DataFrame | None = None
+    ) -> None:
+        self.graphs_table = graphs if graphs is not None else GRAPH_SCHEMA.empty_table().to_pandas()
+        self.nodes = nodes if nodes is not None else NODE_SCHEMA.empty_table().to_pandas()
+        self.edges = edges if edges is not None else EDGE_SCHEMA.empty_table().to_pandas()
+        self._update_rows()
+
+        # graphs added since the last flush, the tables are only concatenated once for all of them
+        self._new_file_ids: set[int] = set()
+        self._new_graphs: list[dict] = []
+        self._new_nodes: list[dict] = []
+        self._new_edges: list[dict] = []
+        return None
+
+    def __str__(self) -> str:
+        self.flush()
+        return f"{self.__class__.__qualname__}(graphs={len(self)}, nodes={len(self.nodes)}, edges={len(self.edges)})"
+
+    def __len__(self) -> int:
+        return len(self._node_rows) + len(self._new_graphs)
+
+    def __contains__(self, file_id: int) -> bool:
+        return file_id in self._node_rows or file_id in self._new_file_ids
+
+    def _update_rows(self) -> None:
+        """Locate the node & edge rows of each graph from the node & edge counts of the graph table."""
+
+        file_ids = self.graphs_table["file_id"].tolist()
+        for counts, attr in ((self.graphs_table["nodes"], "_node_rows"), (self.graphs_table["edges"], "_edge_rows")):
+            offsets = np.concatenate([[0], np.cumsum(counts.to_numpy(np.int64))]).tolist()
+            rows = {
+                file_id: slice(start, stop)
+                for file_id, start, stop in zip(file_ids, offsets[:-1], offsets[1:], strict=True)
+            }
+            setattr(self, attr, rows)
+        return None
+
+    def add(self, graph: nx.DiGraph, file_id: int, game_id: int | None, name: str) -> None:
+        """Add the graph of a program.
+
+        Raises:
+            ValueError: If the file_id is None or the store already contains a graph of the program.
+        """
+
+        if file_id is None:
+            msg = f"the graph of {name} has no file_id, programs without metadata can not be stored"
+            raise ValueError(msg)
+        elif file_id in self:
+            msg = f"the store already contains the graph of file {file_id}"
+            raise ValueError(msg)
+
+        self._new_file_ids.add(file_id)
+        self._new_graphs.append({
+            "file_id": file_id,
+            "game_id": game_id,
+            "name": name,
+            "nodes": graph.number_of_nodes(),
+            "edges": graph.number_of_edges(),
+        })
+
+        positions = {node: idx for idx, node in enumerate(graph.nodes)}
+        for node, attrs in graph.nodes(data=True):
+            self._new_nodes.append({"file_id": file_id, "node": node} | {attr: attrs.get(attr) for attr in NODE_ATTRIBUTES})
+
+        self._new_edges.extend(
+            {"file_id": file_id, "source": positions[source], "target": positions[target]}
+            for source, target in graph.edges
+        )
+        return None
+
+    def flush(self) -> None:
+        """Append the graphs added since the last flush to the tables."""
+
+        if not self._new_graphs:
+            return None
+
+        tables = []
+        for table, rows, schema in (
+            (self.graphs_table, self._new_graphs, GRAPH_SCHEMA),
+            (self.nodes, self._new_nodes, NODE_SCHEMA),
+            (self.edges, self._new_edges, EDGE_SCHEMA),
+        ):
+            new_rows = pa.Table.from_pylist(rows, schema=schema).to_pandas()
+            tables.append(pd.concat([table, new_rows], ignore_index=True) if len(table) else new_rows)
+        self.graphs_table, self.nodes, self.edges = tables
+
+        self._new_file_ids, self._new_graphs, self._new_nodes, self._new_edges = set(), [], [], []
+        self._update_rows()
+        return None
+
+    def write(self, path: str | Path) -> None:
+        """Write the tables into a directory, as graphs.parquet, nodes.parquet and edges.parquet."""
+
+        self.flush()
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        for (file_name, schema), table in zip(TABLES, (self.graphs_table, self.nodes, self.edges), strict=True):
+            pq.write_table(pa.Table.from_pandas(table, schema=schema, preserve_index=False), path / file_name)
+        return None
+
+    @classmethod
+    def read(cls, path: str | Path) -> Self:
+        """Read the tables written with `write`."""
+
+        path = Path(path)
+        return cls(*(pq.read_table(path / file_name, schema=schema).to_pandas() for file_name, schema in TABLES))
+
+    def file_ids(self) -> list[int]:
+        """Return the file_ids of the graphs in the order they were added."""
+
+        self.flush()
+        return list(self._node_rows)
+
+    def node_table(self, file_id: int) -> pd.DataFrame:
+        """Return the node rows of a graph."""
+
+        self.flush()
+        return self.nodes.iloc[self._node_rows[file_id]]
+
+    def edge_array(self, file_id: int) -> np.ndarray:
+        """Return the edges of a graph as an (m, 2) array of the positions of their source and target nodes."""
+
+        self.flush()
+        return self.edges[["source", "target"]].iloc[self._edge_rows[file_id]].to_numpy(np.int64)
+
+    def to_networkx(self, file_id: int) -> nx.DiGraph:
+        """Rebuild the networkx graph of a program, with the node attributes of the ControlFlowGraph."""
+
+        nodes = self.node_table(file_id)
+        names = nodes["node"].tolist()
+        attrs = nodes[NODE_ATTRIBUTES].astype(object).to_dict("records")
+
+        graph = nx.DiGraph()
+        for name, attr in zip(names, attrs, strict=True):
+            # parquet lists are read as arrays and missing tokens as NaN
+            attr["line_jumps"] = [int(line) for line in attr["line_jumps"]]
+            attr["token"] = None if pd.isna(attr["token"]) else attr["token"]
+            graph.add_node(name, **attr)
+
+        graph.add_edges_from((names[source], names[target]) for source, target in self.edge_array(file_id).tolist())
+        return graph
+
+    def to_sparse(self, file_id: int) -> "csr_array":
+        """Return the adjacency matrix of a program as a scipy CSR array, its rows in the node order of the graph.
+
+        scipy is installed with scikit-learn, it is imported here so the store works without it.
+        """
+
+        from scipy.sparse import csr_array
+
+        n = len(self.node_table(file_id))
+        edges = self.edge_array(file_id)
+        return csr_array((np.ones(len(edges), dtype=np.int8), (edges[:, 0], edges[:, 1])), shape=(n, n))
+
+    def to_numpy(self, file_id: int) -> np.ndarray:
+        """Return the dense adjacency matrix of a program, its rows in the node order of the graph."""
+
+        n = len(self.node_table(file_id))
+        matrix = np.zeros((n, n), dtype=np.int8)
+        edges = self.edge_array(file_id)
+        matrix[edges[:, 0], edges[:, 1]] = 1
+        return matrix
+
+    def graphs(self) -> dict[int, nx.DiGraph]:
+        """Rebuild the networkx graphs of all programs by their file_id."""
+        return {file_id: self.to_networkx(file_id) for file_id in self.file_ids()}
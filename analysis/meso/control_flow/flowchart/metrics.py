@@ -103,6 +103,12 @@ class Metrics:
         self._update_df()
         return None
 
+    def add_metrics(self, metrics: dict[str, Any]) -> None:
+        """Add the metrics row of a game calculated by another instance, e.g. in a worker process."""
+        self.metrics = metrics
+        self._update_df()
+        return None
+
     def _calculate_centrality(self, centrality_func: Callable[[nx.DiGraph], dict[str, float]], **kwargs) -> None:
         func_name = centrality_func.__name__
 
@@ -1,4 +1,5 @@
-from collections import Counter
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterator
 from numbers import Real
 
 import networkx as nx
@@ -35,108 +36,151 @@ class Node:
 
 
 class NodeList:
+    """A list of nodes, indexed by name and line.
+
+    The nodes keep the order of the list, appended at the end and reordered by `sort`. Besides, a copy sorted by line
+    is kept up to date with bisect, nodes of the same line in the order they were added, like a stable sort would
+    order them. Lookups by name or line return the first matching node of the list.
+    """
+
     def __init__(self, nodes: list[Node] = None) -> None:
         self.nodes = nodes if nodes else []
         return None
 
+    @property
+    def nodes(self) -> list[Node]:
+        """A copy of the nodes in the order of the list, the methods of the class iterate `_nodes` instead."""
+        return list(self._nodes)
+
+    @nodes.setter
+    def nodes(self, nodes: list[Node]) -> None:
+        # insertion ordered dicts, Node hashes by identity
+        self._nodes: dict[Node, None] = {}
+        self._by_name: dict[str, dict[Node, None]] = {}
+        self._by_line: dict[Real, dict[Node, None]] = {}
+        self._sorted: list[Node] = []
+        self._lines: list[Real] = []
+
+        for node in nodes:
+            self.append(node)
+        return None
+
     def __len__(self) -> int:
-        return len(self.nodes)
+        return len(self._nodes)
+
+    def __iter__(self) -> Iterator[Node]:
+        return iter(self._nodes)
 
     def __str__(self) -> str:
-        return str(self.nodes)
+        return str(list(self._nodes))
 
     def __repr__(self) -> str:
-        return repr(self.nodes)
+        return repr(list(self._nodes))
 
     def __contains__(self, other: Node | str | int) -> bool:
         if isinstance(other, Node):
-            return other.name in [n.name for n in self.nodes]
+            return other.name in self._by_name
         elif isinstance(other, str):
-            return other in [n.name for n in self.nodes]
+            return other in self._by_name
         elif isinstance(other, Real):
-            return other in [n.line for n in self.nodes]
+            return other in self._by_line
         else:
             raise TypeError
 
     def __getitem__(self, other: str | Real | Node) -> Node:
         if isinstance(other, str):
-            for n in self.nodes:
-                if n.name == other:
-                    return n
-
+            nodes = self._by_name.get(other)
         elif isinstance(other, Real):
-            for n in self.nodes:
-                if n.line == other:
-                    return n
-
+            nodes = self._by_line.get(other)
         elif isinstance(other, Node):
-            for n in self.nodes:
-                if n.name == other.name:
-                    return n
-
+            nodes = self._by_name.get(other.name)
         else:
             raise TypeError
 
-        raise IndexError
+        if not nodes:
+            raise IndexError
+        return next(iter(nodes))
 
     def __gt__(self, other: Node) -> list[Node]:
-        self.sort()  # bad practice, do sorting when adding nodes
         if not isinstance(other, Node):
             raise TypeError
 
-        return [n for n in self.nodes if n.line > other.line]
+        return self._sorted[bisect_right(self._lines, other.line) :]
 
     def __lt__(self, other: Node) -> list[Node]:
-        self.sort()  # bad practice, do sorting when adding nodes
         if not isinstance(other, Node):
             raise TypeError
 
-        return [n for n in self.nodes if n.line < other.line]
+        return self._sorted[: bisect_left(self._lines, other.line)]
 
     def __ge__(self, other: Node) -> list[Node]:
-        self.sort()  # bad practice, do sorting when adding nodes
         if not isinstance(other, Node):
             raise TypeError
 
-        return [n for n in self.nodes if n.line >= other.line]
+        return self._sorted[bisect_left(self._lines, other.line) :]
 
     def __le__(self, other: Node) -> list[Node]:
-        self.sort()  # bad practice, do sorting when adding nodes
         if not isinstance(other, Node):
             raise TypeError
 
-        return [n for n in self.nodes if n.line <= other.line]
+        return self._sorted[: bisect_right(self._lines, other.line)]
+
+    def first_after(self, line: Real, inclusive: bool = False) -> Node | None:
+        """Return the first node after a line, or at the line if inclusive, None if there is none."""
+
+        idx = bisect_left(self._lines, line) if inclusive else bisect_right(self._lines, line)
+        return self._sorted[idx] if idx < len(self._sorted) else None
+
+    def last_before(self, line: Real, inclusive: bool = False) -> Node | None:
+        """Return the last node before a line, or at the line if inclusive, None if there is none."""
+
+        idx = bisect_right(self._lines, line) if inclusive else bisect_left(self._lines, line)
+        return self._sorted[idx - 1] if idx else None
 
     def append(self, node: Node) -> None:
-        self.nodes.append(node)
+        self._nodes[node] = None
+        self._by_name.setdefault(node.name, {})[node] = None
+        self._by_line.setdefault(node.line, {})[node] = None
+
+        # after the nodes of the same line, a stable sort keeps them in the order they were added
+        idx = bisect_right(self._lines, node.line)
+        self._sorted.insert(idx, node)
+        self._lines.insert(idx, node.line)
         return None
 
     def remove(self, node) -> None:
         if isinstance(node, Node):
             # Remove by Node object
-            self.nodes.remove(node)
+            if node not in self._nodes:
+                msg = f"{node} not found"
+                raise ValueError(msg)
         elif isinstance(node, str):
             # Remove by name
-            for i, n in enumerate(self.nodes):
-                if n.name == node:
-                    self.nodes.pop(i)
-                    return
-
-            msg = f"Node with name '{node}' not found"
-            raise ValueError(msg)
+            if node not in self._by_name:
+                msg = f"Node with name '{node}' not found"
+                raise ValueError(msg)
+            node = self[node]
         elif isinstance(node, Real):
             # Remove by line number
-            for i, n in enumerate(self.nodes):
-                if n.line == node:
-                    self.nodes.pop(i)
-                    return
-
-            msg = f"Node with line {node} not found"
-            raise ValueError(msg)
+            if node not in self._by_line:
+                msg = f"Node with line {node} not found"
+                raise ValueError(msg)
+            node = self[node]
         else:
             msg = f"Cannot remove node of type {type(node)}"
             raise TypeError(msg)
 
+        del self._nodes[node]
+        for index, key in ((self._by_name, node.name), (self._by_line, node.line)):
+            del index[key][node]
+            if not index[key]:
+                del index[key]
+
+        idx = bisect_left(self._lines, node.line)
+        while self._sorted[idx] is not node:
+            idx += 1
+        del self._sorted[idx]
+        del self._lines[idx]
         return None
 
     def add_line_jumps(self, node: Node) -> None:
@@ -154,12 +198,14 @@ class NodeList:
         return None
 
     def sort(self, reverse: bool = False) -> list[Node]:
-        self.nodes = sorted(self.nodes, key=lambda n: int(n.name.split("_")[1]), reverse=reverse)
+        # the sorted copy already is in the order of a stable sort by line
+        nodes = sorted(self._sorted, key=lambda n: n.line, reverse=True) if reverse else self._sorted
+        self._nodes = dict.fromkeys(nodes)
         return self.nodes
 
     def add_to_graph(self, graph: nx.DiGraph, nodes: list[Node] = None) -> nx.DiGraph:
         if nodes is None:
-            for node in self.nodes:
+            for node in self._nodes:
                 attr = {
                     "prefix": node.prefix,
                     "line": node.line,
@@ -188,13 +234,10 @@ class NodeList:
         return graph
 
     def merge_same_line(self) -> None:
-        line_counts = Counter(node.line for node in self.nodes)
-        duplicate_lines = {line for line, count in line_counts.items() if count > 1}
+        duplicate_lines = {line for line, nodes in self._by_line.items() if len(nodes) > 1}
 
         for line in duplicate_lines:
-            duplicates = sorted(
-                [n for n in self.nodes if n.line == line], key=lambda x: x.subroutine
-            )  # assumption is that one must be a subroutine
+            duplicates = sorted(self._by_line[line], key=lambda x: x.subroutine)  # assumption is that one must be a subroutine
 
             if len(duplicates) == 2:
                 main, subroutine = duplicates
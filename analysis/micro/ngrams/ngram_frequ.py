@@ -1,83 +1,70 @@
 """Lexical abstraction for generalized n-gram modeling with raw frequencies."""
 
+import numpy as np
 import pandas as pd
-from collections import Counter
 import os
+from pathlib import Path
+
+from preprocessing.tokenized_corpus import TokenizedCorpus
+from preprocessing.vocabulary import Vocabulary, count_ngrams
 
 def sentence_split(df):
     """Convert dataframe to list of token lists grouped by file and line."""
-    sentences = []
-    sentence = []
-    prev_line = -1
-
-    for file_id in df["file_id"].unique():
-        file_df = df[df["file_id"] == file_id]
-        for _, row in file_df.iterrows():
-            if row["line"] != prev_line:
-                if sentence:
-                    sentences.append(sentence)
-                    sentence = []
-                prev_line = row["line"]
-
-            sentence.append(row["token"])
-            if row["token"] == ":":
-                sentences.append(sentence)
-                sentence = []
-
-        if sentence:
-            sentences.append(sentence)
-            sentence = []
-
-    return sentences
-
-def is_command(syntax):
-    return syntax.str.startswith("C")
-
-def calculate_bigrams(filtered_tokens, filtered_syntax):
+    # the statements of the lines, a line is split after each ":" token
+    return TokenizedCorpus.from_dataframe(df).statement_tokens()
+
+def load_ids(df, path):
+    """Return the vocabulary and the token & tag id arrays of the dataset.
+
+    The ids are read from the vocab_id & tag_id columns and the vocabulary.json next to the dataset, an older
+    dataset without them is encoded on the fly."""
+    vocabulary_file = Path(path).parent / "vocabulary.json"
+    if {"vocab_id", "tag_id"} <= set(df.columns) and vocabulary_file.is_file():
+        vocabulary = Vocabulary.load(vocabulary_file)
+        return vocabulary, df["vocab_id"].to_numpy(), df["tag_id"].to_numpy()
+
+    vocabulary = Vocabulary()
+    return vocabulary, vocabulary.encode_tokens(df["token"]), vocabulary.encode_tags(df["syntax"])
+
+def tag_mask(vocabulary, first_chars):
+    """Boolean lookup table over the tag ids, True for the tags starting with one of the chars."""
+    return np.array([tag is not None and tag[:1] in first_chars for tag in vocabulary.tags])
+
+def calculate_bigrams(ngram_ids, is_command):
     """Single-pass bigram frequency count after filtering."""
-    bigrams = [
-        (filtered_tokens[i], filtered_tokens[i+1])
-        for i in range(len(filtered_tokens) - 1)
-        if filtered_syntax[i].startswith("C")
-    ]
-    return Counter(bigrams)
-
-def calculate_trigrams(filtered_tokens, filtered_syntax):
+    return count_ngrams([ngram_ids, ngram_ids], starts=is_command)
+
+def calculate_trigrams(ngram_ids, tag_ids, is_command, is_nsv):
     """Single-pass trigram frequency count after filtering."""
-    trigrams = [
-        (filtered_tokens[i], filtered_syntax[i+1], filtered_syntax[i+2])
-        for i in range(len(filtered_tokens) - 2)
-        if filtered_syntax[i].startswith("C") and filtered_syntax[i+1][0] in "NSV"
-    ]
-    return Counter(trigrams)
+    # a trigram starts at a command that is followed by a number, string or variable
+    starts = is_command & np.append(is_nsv[1:], False)
+    return count_ngrams([ngram_ids, tag_ids, tag_ids], starts=starts)
 
 if __name__ == "__main__":
     # --- Load dataset ---
     path = r"C:\Users\eric_\Desktop\Desktop Folders\Schule\BASIC Projektarbeit\tokenized_dataset.parquet"
     df = pd.read_parquet(path)
+    vocabulary, vocab_ids, tag_ids = load_ids(df, path)
 
     # --- Pre-filter / lexical abstraction ---
-    df["ngram_tokens"] = df["syntax"].mask(is_command, df["token"])
-
-    # Flatten tokens and syntax for single-pass processing
-    filtered_tokens = [t for t in df["ngram_tokens"]]
-    filtered_syntax = [s for s in df["syntax"]]
+    # commands are kept as their token, everything else is abstracted to its tag; both share one id space,
+    # the tag ids first and the token ids after them
+    is_command = tag_mask(vocabulary, "C")[tag_ids]
+    is_nsv = tag_mask(vocabulary, "NSV")[tag_ids]
+    ngram_ids = np.where(is_command, vocab_ids.astype(np.int64) + len(vocabulary.tags), tag_ids)
+    labels = np.array(vocabulary.tags + vocabulary.tokens, dtype=object)
 
     # --- Calculate bigrams & trigrams ---
-    bigram_freqs = calculate_bigrams(filtered_tokens, filtered_syntax)
-    trigram_freqs = calculate_trigrams(filtered_tokens, filtered_syntax)
+    bigrams, bigram_counts = calculate_bigrams(ngram_ids, is_command)
+    trigrams, trigram_counts = calculate_trigrams(ngram_ids, tag_ids, is_command, is_nsv)
 
     # --- Save to CSV ---
     output_folder = os.path.dirname(os.path.abspath(__file__))
 
-    bigram_df = pd.DataFrame(
-    [(t1, t2, freq) for (t1, t2), freq in bigram_freqs.items()],
-    columns=["token_1", "token_2", "frequency"]
-)
-    trigram_df = pd.DataFrame(
-    [(t1, t2, t3, freq) for (t1, t2, t3), freq in trigram_freqs.items()],
-    columns=["token_1", "token_2", "token_3", "frequency"]
-)
+    bigram_df = pd.DataFrame(labels[bigrams], columns=["token_1", "token_2"])
+    bigram_df["frequency"] = bigram_counts
+    trigram_df = pd.DataFrame(labels[trigrams], columns=["token_1", "token_2", "token_3"])
+    trigram_df["frequency"] = trigram_counts
 
     bigram_df.to_csv(os.path.join(output_folder, "bigrams_frequ.csv"), index=False)
     trigram_df.to_csv(os.path.join(output_folder, "trigrams_frequ.csv"), index=False)
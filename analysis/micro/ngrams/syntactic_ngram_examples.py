@@ -4,45 +4,20 @@ from typing import Any
 
 import pandas as pd
 
+from preprocessing.tokenized_corpus import TokenizedCorpus
+
 
 def calculate_ngrams(tokens: list[str]) -> Any:
     raise NotImplementedError
 
 
 def sentence_split(df: pd.DataFrame) -> list[list[str]]:
-    """Create a nested list of tokens."""
-
-    sentences = []  # structure: [["REM", "Hello"], ["PRINT", "a$"], ...]
-    sentence = []
-    previous_line = -1
-
-    files = df["file_id"].unique()
-
-    for file in files:
-        # iterate over every file to avoid previous line matching with new file
-        file_df = df[df["file_id"] == file]
+    """Create a nested list of tokens.
 
-        for idx, row in file_df.iterrows():
-            # Start new sentence if line changes
-            if previous_line != row["line"]:
-                if sentence:  # Save current sentence if it exists
-                    sentences.append(sentence)
-                    sentence = []
-                previous_line = row["line"]
-
-            # Add token to current sentence
-            sentence.append(row["token"])
-
-            # End sentence if token is a colon
-            if row["token"] == ":":
-                sentences.append(sentence)
-                sentence = []
-
-        if sentence:
-            # append the last sentence
-            sentences.append(sentences)
+    The sentences are the statements of the lines, a line is split after each ":" token.
+    """
 
-    return sentences
+    return TokenizedCorpus.from_dataframe(df).statement_tokens()
 
 
 def is_command(syntax: pd.Series) -> pd.Series:
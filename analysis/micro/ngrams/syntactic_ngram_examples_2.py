@@ -6,6 +6,8 @@ import pandas as pd
 from nltk.collocations import BigramCollocationFinder, TrigramCollocationFinder
 from nltk.metrics import BigramAssocMeasures, TrigramAssocMeasures
 
+from preprocessing.tokenized_corpus import TokenizedCorpus
+
 
 def calculate_ngrams(
     token_sentences: list[list[str]],
@@ -59,31 +61,12 @@ def calculate_trigrams(
 
 
 def sentence_split(df: pd.DataFrame) -> list[list[str]]:
-    """Create a nested list of tokens grouped by file and line."""
-
-    sentences = []
-    sentence = []
-    previous_line = -1
-
-    files = df["file_id"].unique()
-    for file in files:
-        file_df = df[df["file_id"] == file]
-        for _, row in file_df.iterrows():
-            if previous_line != row["line"]:
-                if sentence:
-                    sentences.append(sentence)
-                    sentence = []
-                previous_line = row["line"]
-
-            sentence.append(row["token"])
-            if row["token"] == ":":
-                sentences.append(sentence)
-                sentence = []
-
-        if sentence:
-            sentences.append(sentence)
-
-    return sentences
+    """Create a nested list of tokens grouped by file and line.
+
+    The sentences are the statements of the lines, a line is split after each ":" token.
+    """
+
+    return TokenizedCorpus.from_dataframe(df).statement_tokens()
 
 
 def is_command(syntax: pd.Series) -> pd.Series:
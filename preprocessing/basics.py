@@ -1,28 +1,179 @@
+from array import array
+from collections.abc import Sequence
 from pathlib import Path
-from typing import Any, Self
+from typing import Any, Literal, Self
 
 import pandas as pd
 
-from preprocessing.petscii import ASCII_CODES
+from preprocessing.petscii import BYTE_CLASSES, DIGIT, LETTER, PUNCTUATION, SIGIL, WHITESPACE
+
+
+LANGUAGES = ("BASIC", "ASSEMBLY")
+BYTE_REPRS = tuple(f"0x{value:02x}" for value in range(256))
+
+TableFormat = Literal["parquet", "feather", "csv", "excel"]
+TABLE_SUFFIXES: dict[str, TableFormat] = {".parquet": "parquet", ".feather": "feather", ".csv": "csv", ".xlsx": "excel"}
+
+
+class TokenBuffer:
+    """A class that stores the tokens of a Commodore BASIC file as parallel arrays.
+
+    The bytes of all tokens are kept in one shared arena, every other attribute in an array with one entry per
+    token. Tags and languages are stored as ids into `tags` and `LANGUAGES`.
+    """
+
+    def __init__(self, tags: Sequence[str | None] = ()) -> None:
+        self.arena = bytearray()
+        self.start = array("I")
+        self.length = array("H")
+        self.value = array("B")  # value of the last byte, used for the byte class checks
+        self.line = array("H")
+        self.tag = array("B")
+        self.language = array("B")
+        self.tokens: list[str] = []
+
+        self.tags: list[str | None] = [None, *(tag for tag in tags if tag is not None)]
+        self.tag_ids = {tag: idx for idx, tag in enumerate(self.tags)}
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__qualname__}(tokens={len(self)}, bytes={len(self.arena)})"
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __getitem__(self, index: int) -> "BASICToken":
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            msg = f"token index {index} out of range"
+            raise IndexError(msg)
+        return BASICToken(self, index)
+
+    def append(self, value: int, lineno: int) -> "BASICToken":
+        """Append a new single-byte token and return its view."""
+
+        self.add(value, lineno, "", 0)
+        return BASICToken(self, len(self.tokens) - 1)
+
+    def add(self, value: int, lineno: int, token: str, tag: int) -> None:
+        """Append a new single-byte token with its decoded token and tag id, without creating a view."""
+
+        self.start.append(len(self.arena))
+        self.arena.append(value)
+        self.length.append(1)
+        self.value.append(value)
+        self.line.append(lineno)
+        self.tag.append(tag)
+        self.language.append(0)
+        self.tokens.append(token)
+        return None
+
+    def add_bytes(self, data: bytes, lineno: int, token: str, tag: int) -> None:
+        """Append a new token of several bytes with its decoded token and tag id, e.g. a whole comment."""
+
+        self.add(data[0], lineno, token, tag)
+        self.arena += data[1:]
+        self.length[-1] = len(data)
+        self.value[-1] = data[-1]
+        return None
+
+    def extend_last(self, value: int, token: str) -> None:
+        """Append a byte and its decoded token to the last token, the tag of the last token is kept."""
+
+        self.arena.append(value)
+        self.length[-1] += 1
+        self.value[-1] = value
+        self.tokens[-1] += token
+        return None
+
+    def extend_last_bytes(self, data: bytes, token: str) -> None:
+        """Append several bytes and their decoded token to the last token, e.g. the rest of a string literal."""
+
+        self.arena += data
+        self.length[-1] += len(data)
+        self.value[-1] = data[-1]
+        self.tokens[-1] += token
+        return None
+
+    def merge_last(self) -> None:
+        """Merge the last token into the token before it. Both tokens are adjacent in the arena."""
+
+        length = self.length.pop()
+        self.length[-1] += length
+        value = self.value.pop()
+        self.value[-1] = value
+        self.start.pop()
+        self.line.pop()
+        self.tag.pop()
+        self.language.pop()
+        token = self.tokens.pop()
+        self.tokens[-1] += token
+        return None
+
+    def tag_id(self, tag: str | None) -> int:
+        """Return the id of a tag, unknown tags are added to the tag list."""
+
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self.tag_ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return tag_id
 
 
 class BASICToken:
-    """A class that represents one token in the Commodore BASIC programming language."""
+    """A class that represents one token in the Commodore BASIC programming language.
+
+    The token is a view on one entry of a TokenBuffer.
+    """
 
-    def __init__(self, value: int, lineno: int, **kwargs) -> None:
-        self.value = value
-        self.lineno = lineno
+    __slots__ = ("buffer", "index")
+
+    def __init__(self, buffer: TokenBuffer, index: int) -> None:
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def value(self) -> int:
+        """The value of the last byte of the token."""
+        return self.buffer.value[self.index]
 
-        self._byte = kwargs.get("byte", bytearray([value]))
-        self.byte_repr: str = kwargs.get("byteRepr", f"0x{value:02x}")
-        self.syntax: str | None = kwargs.get("syntax")
-        self.token: str = kwargs.get("token", "")
-        self.language: str = kwargs.get("language", "BASIC")
+    @property
+    def lineno(self) -> int:
+        return self.buffer.line[self.index]
 
     @property
     def byte(self) -> bytes:
         """The bytes representation of the token."""
-        return bytes(self._byte)
+        start = self.buffer.start[self.index]
+        return bytes(self.buffer.arena[start : start + self.buffer.length[self.index]])
+
+    @property
+    def byte_repr(self) -> str:
+        return " ".join([BYTE_REPRS[value] for value in self.byte])
+
+    @property
+    def token(self) -> str:
+        return self.buffer.tokens[self.index]
+
+    @token.setter
+    def token(self, token: str) -> None:
+        self.buffer.tokens[self.index] = token
+
+    @property
+    def syntax(self) -> str | None:
+        return self.buffer.tags[self.buffer.tag[self.index]]
+
+    @syntax.setter
+    def syntax(self, syntax: str | None) -> None:
+        self.buffer.tag[self.index] = self.buffer.tag_id(syntax)
+
+    @property
+    def language(self) -> str:
+        return LANGUAGES[self.buffer.language[self.index]]
+
+    @language.setter
+    def language(self, language: str) -> None:
+        self.buffer.language[self.index] = LANGUAGES.index(language)
 
     def __str__(self) -> str:
         return (
@@ -33,26 +184,16 @@ class BASICToken:
         return f"{self.__class__.__qualname__}(value={self.value!r}, byte={self.byte!r}, byteRepr={self.byte_repr!r}, token={self.token!r}, syntax={self.syntax!r})"
 
     def __len__(self) -> int:
-        return len(self.byte)
-
-    def __add__(self, other: Self) -> Self:
-        self._add_check_other(other)
-
-        value = self.value  # hmm..
-        byte = self.byte + other.byte
-        byte_repr = self.byte_repr + other.byte_repr
-        token = self.token + " " + other.token
-
-        return self.__class__(value, self.lineno, byte=byte, byteRepr=byte_repr, token=token)
+        return self.buffer.length[self.index]
 
     def __iadd__(self, other: Self) -> Self:
         self._add_check_other(other)
 
-        self.value = other.value  # hmm..
-        self._byte = self.byte + other.byte
-        self.byte_repr = self.byte_repr + " " + other.byte_repr
-        self.token = self.token + other.token
+        if self.buffer is not other.buffer or not self.index + 1 == other.index == len(self.buffer) - 1:
+            msg = "Can only add the last token of a buffer to the token before it"
+            raise ValueError(msg)
 
+        self.buffer.merge_last()
         return self
 
     def _add_check_other(self, other: Any) -> None:
@@ -70,23 +211,23 @@ class BASICToken:
 
     def is_whitespace(self) -> bool:
         """Check if token contains only an empty space."""
-        return self.byte == b" "
+        return len(self) == 1 and bool(BYTE_CLASSES[self.value] & WHITESPACE)
 
     def is_digit(self) -> bool:
         """Check if token is an ASCII digit."""
-        return self.value in ASCII_CODES["number"]
+        return bool(BYTE_CLASSES[self.value] & DIGIT)
 
     def is_letter(self) -> bool:
         """Check if token is an ASCII letter."""
-        return self.value in ASCII_CODES["letter"]
+        return bool(BYTE_CLASSES[self.value] & LETTER)
 
     def is_punctuation(self) -> bool:
         """Check if token is an ASCII punctuation but not a sigil."""
-        return self.value in ASCII_CODES["punctuation"]
+        return bool(BYTE_CLASSES[self.value] & PUNCTUATION)
 
     def is_sigil(self) -> bool:
         """Check if token is an BASIC sigil."""
-        return self.value in ASCII_CODES["sigil"]
+        return bool(BYTE_CLASSES[self.value] & SIGIL)
 
     def is_alpha(self) -> bool:
         if not self.token:
@@ -97,27 +238,46 @@ class BASICToken:
 class BASICFile:
     """A class that represents a Commodore BASIC file containing a dict with BASICToken elements."""
 
-    def __init__(self) -> None:
-        self.file: list[tuple[int, list[BASICToken]]] = []
+    def __init__(self, tags: Sequence[str | None] = ()) -> None:
+        self.buffer = TokenBuffer(tags)
+        self.lines: list[tuple[int, int, int]] = []  # (lineno, first token index, end token index)
 
     def __str__(self) -> str:
         return f"{self.__class__.__qualname__}()"
 
-    # def __getitem__(self, index) -> list[BASICToken]:
-    #     return self.file[index]
-
-    # def print_line(self, index: int = -1) -> None:
-    #     if index == -1:
-    #         index = max(self.file.keys())
-
-    #     token_line = " ".join([btoken.token for btoken in self.file[index]])
-    #     print(f"{index:>5d} {token_line}")
-    #     return None
+    @property
+    def file(self) -> list[tuple[int, list[BASICToken]]]:
+        """The lines of the file as (lineno, tokens) tuples."""
+        return [
+            (lineno, [BASICToken(self.buffer, idx) for idx in range(start, end)]) for lineno, start, end in self.lines
+        ]
 
     def add_line(self, tokens: list[BASICToken], lineno: int) -> None:
-        self.file.append((lineno, tokens))
+        """Add a line whose tokens are the last tokens in the buffer."""
+
+        end = len(self.buffer)
+        self.lines.append((lineno, end - len(tokens), end))
         return None
 
+    def columns(self) -> dict[str, list]:
+        """Return the token table of the BASIC file as a dict of column lists."""
+
+        buffer = self.buffer
+        columns: dict[str, list] = {key: [] for key in ("line", "token_id", "bytes", "token", "syntax", "language")}
+
+        for lineno, start, end in self.lines:
+            columns["line"].extend([lineno] * (end - start))
+            columns["token_id"].extend(range(end - start))
+            columns["token"].extend(buffer.tokens[start:end])
+            columns["syntax"].extend([buffer.tags[tag] for tag in buffer.tag[start:end]])
+            columns["language"].extend([LANGUAGES[language] for language in buffer.language[start:end]])
+
+            arena = buffer.arena
+            for offset, length in zip(buffer.start[start:end], buffer.length[start:end], strict=True):
+                columns["bytes"].append(" ".join([BYTE_REPRS[value] for value in arena[offset : offset + length]]))
+
+        return columns
+
     def save_file(self, path: str | Path) -> None:
         """Save the BASIC file as an text file."""
         data = []
@@ -130,14 +290,38 @@ class BASICFile:
             file.write("\n".join(data))
         return None
 
-    def save_table(self, path: str | Path) -> pd.DataFrame:
-        """Save the BASIC file as an Excel file."""
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return the token table of the BASIC file as a DataFrame."""
+        return pd.DataFrame(self.columns())
+
+    def save_table(self, path: str | Path, table_format: TableFormat | None = None) -> pd.DataFrame:
+        """Save the token table of the BASIC file as a Parquet, Feather, CSV or Excel file.
+
+        Args:
+            path (str | Path): The path of the table file.
+            table_format (TableFormat | None): The file format, if None it is derived from the file suffix.
+
+        Returns:
+            pd.DataFrame: The token table.
+        """
+
+        path = Path(path)
+        if table_format is None:
+            table_format = TABLE_SUFFIXES.get(path.suffix)
 
-        df = pd.DataFrame(columns=["line", "token_id", "bytes", "token", "syntax", "language"])
+        df = self.to_dataframe()
 
-        for lineno, btokens in self.file:
-            for idx, btoken in enumerate(btokens):
-                df.loc[len(df)] = [lineno, idx, btoken.byte_repr, btoken.token, btoken.syntax, btoken.language]
+        match table_format:
+            case "parquet":
+                df.to_parquet(path, index=False)
+            case "feather":
+                df.to_feather(path)
+            case "csv":
+                df.to_csv(path, index=False)
+            case "excel":
+                df.to_excel(path)
+            case _:
+                msg = f"unknown table format {table_format!r} for {path.name}"
+                raise ValueError(msg)
 
-        df.to_excel(path)
         return df
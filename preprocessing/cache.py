@@ -0,0 +1,59 @@
+"""The script provides an on-disk cache for the token tables of lexed programs."""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from preprocessing.lexer import LEXER_VERSION
+
+
+class LexerCache:
+    """A class that stores the token table of each lexed program under a hash of its content.
+
+    The key is a hash of the PRG bytes, the tagset and the lexer version, so a changed file, tagset or lexer
+    never reads a stale table.
+    """
+
+    def __init__(self, cache_dir: str | Path, tagset: dict) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        tagset_json = json.dumps(tagset, sort_keys=True)
+        self.salt = hashlib.sha256(f"{LEXER_VERSION}\n{tagset_json}".encode()).digest()
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__qualname__}({self.cache_dir})"
+
+    def key(self, data: bytes) -> str:
+        """Return the cache key of a program."""
+        return hashlib.sha256(self.salt + data).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.parquet"
+
+    def __contains__(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def get(self, key: str) -> dict[str, list] | None:
+        """Return the cached token table as column lists or None if the key is not cached."""
+
+        path = self.path(key)
+        if not path.is_file():
+            return None
+        return pq.read_table(path).to_pydict()
+
+    def put(self, key: str, columns: dict[str, list]) -> None:
+        """Store a token table given as column lists."""
+
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+
+        # write to a temporary file first, so an interrupted run never leaves a broken table behind
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        pq.write_table(pa.table(columns), tmp_path)
+        tmp_path.replace(path)
+        return None
@@ -0,0 +1,158 @@
+"""The script lexes all encoded BASIC files of the corpus into the tokenized dataset."""
+
+import argparse
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+from rich import print, traceback
+
+from preprocessing.basics import TABLE_SUFFIXES, TableFormat
+from preprocessing.cache import LexerCache
+from preprocessing.dataset import TokenDatasetWriter, read_metadata
+from preprocessing.lexer import Lexer
+from preprocessing.tagset import TAGSET
+from preprocessing.vocabulary import Vocabulary
+
+
+traceback.install()
+
+CORPUS_PATH = Path(
+    "/Users/julian/Documents/3 - Bildung/31 - Studium/314 Universität Stuttgart/314.2 Semester 2/Projektarbeit/corpus"
+)
+DISKS = ("Homecomp1", "Homecomp2", "Homecomp3")
+SKIPPED_FILES = (".DS_Store", "inv-mc", "spukhaus2")
+
+_lexer: Lexer | None = None  # one lexer per worker process
+
+
+def find_source_files(source_path: Path, disks: Iterable[str] = DISKS) -> list[Path]:
+    """Return the encoded BASIC files of all disks in a deterministic order."""
+
+    source_files = []
+    for disk in disks:
+        source_files.extend(sorted(file for file in (source_path / disk).iterdir() if file.name not in SKIPPED_FILES))
+
+    return source_files
+
+
+def lex_file(source_file: Path, table_file: Path | None = None) -> dict[str, list]:
+    """Lex one encoded BASIC file, optionally save its token table and return the table as column lists.
+
+    This is the worker function of the process pool, each worker process creates its own Lexer.
+    """
+
+    global _lexer
+    if _lexer is None:
+        _lexer = Lexer(TAGSET)
+
+    bfile = _lexer.detokenize_basic_file(source_file)
+    if table_file is not None:
+        bfile.save_table(table_file)
+
+    columns = bfile.columns()
+    return {"name": [source_file.name] * len(columns["line"])} | columns
+
+
+def lex_corpus(
+    source_files: list[Path],
+    table_path: Path,
+    jobs: int = 1,
+    table_format: TableFormat | None = "parquet",
+    cache: LexerCache | None = None,
+) -> Iterator[dict[str, list]]:
+    """Lex the files in a process pool and yield their columns in the order of `source_files`.
+
+    Args:
+        source_files (list[Path]): The encoded BASIC files.
+        table_path (Path): The directory for the token tables of the single files.
+        jobs (int): The number of worker processes, 1 lexes in the current process.
+        table_format (TableFormat | None): The file format of the single token tables, None saves no tables.
+        cache (LexerCache | None): If given, unchanged files are read from the cache and only new or modified
+            files are lexed.
+
+    Yields:
+        dict[str, list]: The token table of one file as column lists.
+    """
+
+    if table_format is None:
+        table_files = [None] * len(source_files)
+    else:
+        suffix = {table_format: suffix for suffix, table_format in TABLE_SUFFIXES.items()}[table_format]
+        table_files = [table_path / file.parent.name / f"{file.name}{suffix}" for file in source_files]
+        for table_dir in {file.parent for file in table_files}:
+            table_dir.mkdir(parents=True, exist_ok=True)
+
+    keys = [cache.key(file.read_bytes()) if cache else None for file in source_files]
+    is_cached = [
+        cache is not None and key in cache and (table_file is None or table_file.exists())
+        for key, table_file in zip(keys, table_files, strict=True)
+    ]
+    to_lex = [
+        (file, table_file) for file, table_file, hit in zip(source_files, table_files, is_cached, strict=True) if not hit
+    ]
+    print(f"{len(source_files) - len(to_lex)} files cached, {len(to_lex)} files to lex")
+
+    with ProcessPoolExecutor(max_workers=jobs) if jobs > 1 and to_lex else nullcontext() as executor:
+        # a pool is only started if there is something to lex
+        map_func = executor.map if executor else map
+        lexed = map_func(lex_file, *zip(*to_lex, strict=True)) if to_lex else iter(())
+
+        for file, key, hit in zip(source_files, keys, is_cached, strict=True):
+            if hit:
+                columns = cache.get(key)
+                yield {"name": [file.name] * len(columns["line"])} | columns
+                continue
+
+            columns = next(lexed)
+            if cache:
+                cache.put(key, {name: column for name, column in columns.items() if name != "name"})
+            yield columns
+
+    return None
+
+
+def sort_by_game(source_files: list[Path], metadata: dict[str, tuple[int, int]]) -> list[Path]:
+    """Sort the files by game_id, file_id and name, files without metadata come last."""
+
+    def key(file: Path) -> tuple[bool, int, int, str]:
+        file_id, game_id = metadata.get(file.name, (None, None))
+        return (game_id is None, game_id or 0, file_id or 0, file.name)
+
+    return sorted(source_files, key=key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lex all encoded BASIC files of the corpus.")
+    parser.add_argument("--corpus", type=Path, default=CORPUS_PATH, help="the corpus directory")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument(
+        "--table-format",
+        choices=[*TABLE_SUFFIXES.values(), "none"],
+        default="parquet",
+        help="file format of the token table of each file",
+    )
+    parser.add_argument("--cache", type=Path, help="the lexer cache directory, defaults to <corpus>/cache")
+    parser.add_argument("--no-cache", action="store_true", help="lex all files without reading or writing the cache")
+    args = parser.parse_args()
+
+    source_path = args.corpus / "encoded"
+    table_path = args.corpus / "dataset"
+
+    cache = None if args.no_cache else LexerCache(args.cache or args.corpus / "cache", TAGSET)
+    metadata = read_metadata(args.corpus / "metadata.xlsx")
+    source_files = sort_by_game(find_source_files(source_path), metadata)
+    print(f"lexing {len(source_files)} files with {args.jobs} jobs")
+
+    vocabulary_file = table_path / "vocabulary.json"
+    vocabulary = Vocabulary.load_or_create(vocabulary_file)
+
+    with TokenDatasetWriter(table_path / "tokenized_dataset.parquet", metadata, vocabulary) as writer:
+        table_format = None if args.table_format == "none" else args.table_format
+        for columns in lex_corpus(source_files, table_path, args.jobs, table_format, cache):
+            writer.write_program(columns)
+
+    vocabulary.save(vocabulary_file)
+    print(f"{writer.rows} tokens written to {writer.path}, {vocabulary} saved to {vocabulary_file}")
@@ -0,0 +1,216 @@
+"""The script provides a reader for Commodore 1541 disk images (.d64) that works without the VICE tools."""
+
+from collections.abc import Generator, Iterator
+from contextlib import AbstractContextManager
+from pathlib import Path
+from typing import NamedTuple, Self
+
+from preprocessing.prg import open_prg
+
+
+SECTOR_SIZE = 256
+BAM_TRACK = 18  # the BAM is sector 0 of the directory track
+FILE_TYPES = ("DEL", "SEQ", "PRG", "USR", "REL")
+
+# image size -> number of tracks, images with an error info block have one extra byte per sector
+IMAGE_TRACKS = {174_848: 35, 175_531: 35, 196_608: 40, 197_376: 40}
+
+FILENAME_PADDING = 0xA0
+
+
+def sectors_per_track(track: int) -> int:
+    """Return the number of sectors of a track, the outer tracks hold more sectors."""
+
+    if track <= 17:
+        return 21
+    elif track <= 24:
+        return 19
+    elif track <= 30:
+        return 18
+    return 17
+
+
+def _build_track_offsets() -> tuple[int, ...]:
+    """Build the offset of the first sector of each track in sectors, track numbers start at 1."""
+
+    offsets = [0, 0]
+    for track in range(1, 40):
+        offsets.append(offsets[-1] + sectors_per_track(track))
+    return tuple(offsets)
+
+
+TRACK_OFFSETS = _build_track_offsets()
+
+
+def _build_filename_table() -> bytes:
+    """Build the translation table of PETSCII filename bytes to the ASCII names c1541 extracts."""
+
+    table = bytearray(b"_" * 256)
+    for value in range(0x20, 0x7F):
+        table[value] = value
+    for value in range(0x41, 0x5B):
+        table[value] = value + 0x20  # unshifted PETSCII letters are lowercase
+        table[value + 0x20] = value
+        table[value + 0x80] = value  # shifted PETSCII letters are uppercase
+    table[ord("/")] = ord("_")
+    return bytes(table)
+
+
+FILENAME_TABLE = _build_filename_table()
+
+
+class BAM(NamedTuple):
+    disk_name: str
+    disk_id: str
+    directory_start: tuple[int, int]  # track & sector of the first directory sector
+    free_sectors: dict[int, int]  # track -> number of free sectors
+
+
+class DirectoryEntry(NamedTuple):
+    name: str
+    file_type: str
+    closed: bool
+    start: tuple[int, int]  # track & sector of the first data sector
+    blocks: int
+
+
+class D64Image:
+    """A class that reads the BAM, directory and files of a memory-mapped D64 disk image.
+
+    Use it as a context manager, sectors are zero-copy views of the image and only valid inside the context.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+
+        size = self.path.stat().st_size
+        if size not in IMAGE_TRACKS:
+            msg = f"{self.path.name} is not a D64 image, unexpected size of {size} bytes"
+            raise ValueError(msg)
+        self.tracks = IMAGE_TRACKS[size]
+
+        self._context: AbstractContextManager[memoryview] | None = None
+        self._view: memoryview | None = None
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__qualname__}({self.path.name}, tracks={self.tracks})"
+
+    def __enter__(self) -> Self:
+        self._context = open_prg(self.path)
+        self._view = self._context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._view = None
+        self._context.__exit__(*exc_info)
+        self._context = None
+        return None
+
+    def sector(self, track: int, sector: int) -> memoryview:
+        """Return the 256 bytes of a sector."""
+
+        if not (1 <= track <= self.tracks and 0 <= sector < sectors_per_track(track)):
+            msg = f"sector {track}/{sector} is outside of {self.path.name}"
+            raise ValueError(msg)
+
+        offset = (TRACK_OFFSETS[track] + sector) * SECTOR_SIZE
+        return self._view[offset : offset + SECTOR_SIZE]
+
+    def sectors(self, track: int, sector: int) -> Iterator[memoryview]:
+        """Follow a sector chain from its first sector and yield each sector.
+
+        The first two bytes of a sector link to the next sector, the chain ends at a link to track 0.
+        """
+
+        visited = set()
+        while track:
+            if (track, sector) in visited:
+                msg = f"sector chain of {self.path.name} loops at {track}/{sector}"
+                raise ValueError(msg)
+            visited.add((track, sector))
+
+            data = self.sector(track, sector)
+            yield data
+            track, sector = data[0], data[1]
+
+        return None
+
+    def chain(self, track: int, sector: int) -> Iterator[memoryview]:
+        """Follow a sector chain and yield the used data bytes of each sector.
+
+        In the last sector of a chain the second byte is the index of the last used byte.
+        """
+
+        for data in self.sectors(track, sector):
+            yield data[2:] if data[0] else data[2 : data[1] + 1]
+
+        return None
+
+    def read_bam(self) -> BAM:
+        """Parse the block availability map."""
+
+        data = self.sector(BAM_TRACK, 0)
+        free_sectors = {track: data[4 * track] for track in range(1, min(self.tracks, 35) + 1)}
+
+        return BAM(
+            disk_name=bytes(data[0x90:0xA0]).rstrip(bytes([FILENAME_PADDING])).translate(FILENAME_TABLE).decode(),
+            disk_id=bytes(data[0xA2:0xA4]).translate(FILENAME_TABLE).decode(),
+            directory_start=(data[0], data[1]),
+            free_sectors=free_sectors,
+        )
+
+    def directory(self) -> list[DirectoryEntry]:
+        """Read all files of the directory chain, scratched entries are skipped."""
+
+        entries = []
+        for data in self.sectors(*self.read_bam().directory_start):
+            # each sector holds 8 entries of 32 bytes, the chain link takes the first 2 bytes of the first entry
+            for offset in range(0, SECTOR_SIZE, 32):
+                entry = data[offset : offset + 32]
+                file_type = entry[2]
+                if file_type == 0x00:
+                    continue
+
+                name = bytes(entry[5:21]).rstrip(bytes([FILENAME_PADDING])).translate(FILENAME_TABLE).decode()
+                entries.append(
+                    DirectoryEntry(
+                        name=name,
+                        file_type=FILE_TYPES[file_type & 0x07] if file_type & 0x07 < len(FILE_TYPES) else "???",
+                        closed=bool(file_type & 0x80),
+                        start=(entry[3], entry[4]),
+                        blocks=entry[30] | entry[31] << 8,
+                    )
+                )
+
+        return entries
+
+    def read_file(self, entry: DirectoryEntry) -> bytes:
+        """Read the content of a file by following its sector chain."""
+        return b"".join(self.chain(*entry.start))
+
+    def programs(self) -> Iterator[tuple[str, bytes]]:
+        """Yield the name and content, including the load address, of each PRG file on the disk."""
+
+        for entry in self.directory():
+            if entry.file_type == "PRG" and entry.closed:
+                yield (entry.name, self.read_file(entry))
+
+        return None
+
+
+def read_programs(path: str | Path) -> Generator[tuple[str, bytes], None, None]:
+    """Read all PRG files of a D64 image in memory.
+
+    The content can be passed directly to `Lexer.detokenize_buffer`, no file has to be extracted to the disk.
+
+    Args:
+        path (str | Path): The D64 image.
+
+    Yields:
+        tuple[str, bytes]: The filename as extracted by c1541 and the content of each program.
+    """
+
+    with D64Image(path) as image:
+        yield from image.programs()
+
+    return None
@@ -0,0 +1,327 @@
+"""The script provides a streaming writer for the tokenized dataset, its offset index and its partitioned form."""
+
+import os
+from pathlib import Path
+from typing import NamedTuple, Self
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from preprocessing.vocabulary import Vocabulary
+
+
+DICTIONARY_COLUMNS = ["name", "token", "syntax", "language"]
+
+SCHEMA = pa.schema([
+    ("file_id", pa.int64()),
+    ("game_id", pa.int64()),
+    ("name", pa.dictionary(pa.int32(), pa.string())),
+    ("line", pa.int64()),
+    ("token_id", pa.int64()),
+    ("bytes", pa.string()),
+    ("token", pa.dictionary(pa.int32(), pa.string())),
+    ("syntax", pa.dictionary(pa.int32(), pa.string())),
+    ("language", pa.dictionary(pa.int32(), pa.string())),
+    ("vocab_id", pa.uint32()),  # ids of the token & syntax columns in the vocabulary of the dataset
+    ("tag_id", pa.uint8()),
+])
+
+# the sidecar index of the dataset, one row per program
+INDEX_SCHEMA = pa.schema([
+    ("game_id", pa.int64()),
+    ("file_id", pa.int64()),
+    ("name", pa.string()),
+    ("row_group", pa.int32()),
+    ("start", pa.int64()),  # the rows of the program in the whole dataset
+    ("stop", pa.int64()),
+])
+
+# the partitioned dataset has a directory game_id=<id> per game, hive-style, with one file <disk>/<name> per program
+PARTITION_FIELD = "game_id"
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"  # programs without metadata, read back as a null game_id
+
+
+def read_metadata(metadata_file: Path) -> dict[str, tuple[int, int]]:
+    """Read the file_id and game_id of each program name from the metadata table."""
+
+    metadata_df = pd.read_excel(metadata_file)
+    metadata_df = metadata_df.drop_duplicates("name")
+    return {
+        name: (int(file_id), int(game_id))
+        for name, file_id, game_id in metadata_df[["name", "file_id", "game_id"]].itertuples(index=False)
+    }
+
+
+def program_batch(
+    columns: dict[str, list], file_id: int | None, game_id: int | None, vocabulary: Vocabulary
+) -> pa.RecordBatch:
+    """Convert the token table of one program, given as column lists, into a record batch sorted by line & token.
+
+    The token and syntax columns are encoded with the vocabulary as well, unknown tokens and tags are added to it.
+    """
+
+    rows = len(columns["name"])
+    arrays = {
+        "file_id": pa.array([file_id] * rows, pa.int64()),
+        "game_id": pa.array([game_id] * rows, pa.int64()),
+        "vocab_id": pa.array(vocabulary.encode_tokens(columns["token"]), pa.uint32()),
+        "tag_id": pa.array(vocabulary.encode_tags(columns["syntax"]), pa.uint8()),
+    }
+    for field in SCHEMA:
+        if field.name in arrays:
+            continue
+        array = pa.array(columns[field.name], pa.string() if pa.types.is_dictionary(field.type) else field.type)
+        arrays[field.name] = array.dictionary_encode() if pa.types.is_dictionary(field.type) else array
+
+    batch = pa.RecordBatch.from_pydict(arrays, schema=SCHEMA)
+    indices = pc.sort_indices(batch, sort_keys=[("line", "ascending"), ("token_id", "ascending")])
+    return batch.take(indices)
+
+
+def partition_file(dataset_dir: Path, disk: str, name: str, game_id: int | None) -> Path:
+    """Return the file of a program in the partitioned dataset.
+
+    The disk directory keeps programs of the same name apart, e.g. two programs without metadata in the null
+    partition. It is not a key=value directory, so it is ignored when the dataset is read with hive partitioning.
+    """
+
+    partition = NULL_PARTITION if game_id is None else game_id
+    return dataset_dir / f"{PARTITION_FIELD}={partition}" / disk / f"{name}.parquet"
+
+
+def write_partition_file(
+    dataset_dir: str | Path,
+    disk: str,
+    columns: dict[str, list],
+    metadata: dict[str, tuple[int, int]],
+    vocabulary: Vocabulary,
+) -> Path | None:
+    """Write the token table of one program into the partition of its game.
+
+    Only the file of the program is written, the other files of the partition and all other partitions are left as
+    they are. A copy of the program in another partition, written before its game_id was known or with an older
+    game_id, is removed. Programs of the same name on other disks are kept.
+
+    Args:
+        dataset_dir (str | Path): The root directory of the partitioned dataset.
+        disk (str): The disk directory of the program in the encoded corpus.
+        columns (dict[str, list]): The token table of the program as column lists with a 'name' column.
+        metadata (dict[str, tuple[int, int]]): The file_id and game_id of each program name.
+        vocabulary (Vocabulary): The vocabulary of the dataset, the caller saves it once the new ids are written.
+
+    Returns:
+        Path | None: The written file, None if the program has no tokens.
+    """
+
+    if not columns["name"]:
+        return None
+
+    dataset_dir = Path(dataset_dir)
+    name = columns["name"][0]
+    file_id, game_id = metadata.get(name, (None, None))
+    path = partition_file(dataset_dir, disk, name, game_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # the game_id is stored in the directory name only
+    table = pa.Table.from_batches([program_batch(columns, file_id, game_id, vocabulary)]).drop_columns([PARTITION_FIELD])
+
+    # write to a temporary file first, so a reader of the dataset never sees a half-written file
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path, use_dictionary=DICTIONARY_COLUMNS, store_schema=False)
+    tmp_path.replace(path)
+
+    # the same disk & name in another partition is a copy of this program, written with an older game_id
+    for partition in dataset_dir.glob(f"{PARTITION_FIELD}=*"):
+        stale_path = partition / disk / path.name
+        if stale_path != path and stale_path.is_file():
+            stale_path.unlink()
+
+    return path
+
+
+def index_path(dataset_path: str | Path) -> Path:
+    """Return the path of the sidecar index of a dataset file."""
+    return Path(dataset_path).with_suffix(".index.parquet")
+
+
+class IndexEntry(NamedTuple):
+    game_id: int | None
+    file_id: int | None
+    name: str
+    row_group: int
+    start: int
+    stop: int
+
+    @property
+    def rows(self) -> slice:
+        """The rows of the program in the whole dataset."""
+        return slice(self.start, self.stop)
+
+
+class TokenDatasetIndex:
+    """A class that locates the rows of each game and program in the tokenized dataset.
+
+    The dataset is sorted by game, each game is one row group and the rows of a program are contiguous. The rows
+    of a program are therefore a slice of the whole dataset or of the row group of its game, no column has to be
+    scanned to find them.
+    """
+
+    def __init__(self, entries: list[IndexEntry]) -> None:
+        self.entries = entries
+        # programs without metadata have no file_id, they can only be found through their game
+        self.by_file = {entry.file_id: entry for entry in entries if entry.file_id is not None}
+
+        self.by_game: dict[int | None, list[IndexEntry]] = {}
+        for entry in entries:
+            self.by_game.setdefault(entry.game_id, []).append(entry)
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__qualname__}(games={len(self.by_game)}, files={len(self.entries)})"
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @classmethod
+    def read(cls, dataset_path: str | Path) -> Self:
+        """Read the sidecar index of a dataset file."""
+
+        table = pq.read_table(index_path(dataset_path), schema=INDEX_SCHEMA)
+        return cls([IndexEntry(*row) for row in zip(*table.to_pydict().values(), strict=True)])
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> Self:
+        """Build the index of a token table that is sorted by game and program, e.g. an older dataset file.
+
+        Raises:
+            ValueError: If the rows of a program are not contiguous.
+        """
+
+        keys = df[["game_id", "file_id"]].astype("Int64")
+        changes = (keys != keys.shift()).any(axis=1).to_numpy().nonzero()[0].tolist()
+
+        entries = []
+        for start, stop in zip(changes, [*changes[1:], len(df)], strict=True):
+            game_id, file_id = keys.iloc[start]
+            entries.append(IndexEntry(
+                None if pd.isna(game_id) else int(game_id),
+                None if pd.isna(file_id) else int(file_id),
+                df["name"].iloc[start],
+                -1,  # no row groups in memory
+                start,
+                stop,
+            ))
+
+        file_ids = [entry.file_id for entry in entries if entry.file_id is not None]
+        if len(set(file_ids)) != len(file_ids):
+            msg = "the rows of each program must be contiguous, sort the table by game_id and file_id"
+            raise ValueError(msg)
+        return cls(entries)
+
+    def write(self, dataset_path: str | Path) -> None:
+        table = pa.Table.from_pylist([entry._asdict() for entry in self.entries], schema=INDEX_SCHEMA)
+        pq.write_table(table, index_path(dataset_path))
+        return None
+
+    def games(self) -> list[int | None]:
+        """Return the game_ids in the order of the dataset."""
+        return list(self.by_game)
+
+    def files(self, game_id: int | None) -> list[IndexEntry]:
+        """Return the programs of a game in the order of the dataset."""
+        return self.by_game[game_id]
+
+    def file_rows(self, file_id: int) -> slice:
+        """Return the rows of a program in the whole dataset."""
+        return self.by_file[file_id].rows
+
+    def game_rows(self, game_id: int | None) -> slice:
+        """Return the rows of all programs of a game in the whole dataset."""
+
+        entries = self.by_game[game_id]
+        return slice(entries[0].start, entries[-1].stop)
+
+    def read_file(self, parquet_file: pq.ParquetFile, file_id: int, columns: list[str] | None = None) -> pd.DataFrame:
+        """Read the rows of one program, only the row group of its game is read from the dataset file."""
+
+        entry = self.by_file[file_id]
+        first = self.by_game[entry.game_id][0].start
+        table = parquet_file.read_row_group(entry.row_group, columns=columns)
+        return table.slice(entry.start - first, entry.stop - entry.start).to_pandas()
+
+
+class TokenDatasetWriter:
+    """A class that streams the token tables of lexed programs into one Parquet file.
+
+    The programs must be written in the order of their game_id, all programs of a game are written as one row group.
+    Only the tokens of the current game are kept in memory. On close a sidecar index with the rows of each program
+    is written next to the dataset, see `TokenDatasetIndex`. The token & tag ids are taken from `vocabulary`, the
+    vocabulary has to be saved along with the dataset.
+    """
+
+    def __init__(
+        self, path: str | Path, metadata: dict[str, tuple[int, int]], vocabulary: Vocabulary | None = None
+    ) -> None:
+        self.path = Path(path)
+        self.metadata = metadata
+        self.vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.writer = pq.ParquetWriter(self.path, SCHEMA, use_dictionary=DICTIONARY_COLUMNS, store_schema=False)
+        self.game_id: int | None = None
+        self.batches: list[pa.RecordBatch] = []
+        self.rows = 0
+
+        self.index: list[IndexEntry] = []
+        self.row_groups = 0
+        self.written_games: set[int | None] = set()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+        return None
+
+    def write_program(self, columns: dict[str, list]) -> None:
+        """Add the token table of one program, given as column lists with a 'name' column."""
+
+        if not columns["name"]:
+            return None
+
+        name = columns["name"][0]
+        file_id, game_id = self.metadata.get(name, (None, None))
+        if game_id != self.game_id:
+            self.flush()
+            if game_id in self.written_games:
+                msg = f"the programs of game {game_id} must be written one after another, {name} comes too late"
+                raise ValueError(msg)
+            self.game_id = game_id
+
+        start = self.rows + sum(batch.num_rows for batch in self.batches)
+        rows = len(columns["name"])
+        self.index.append(IndexEntry(game_id, file_id, name, self.row_groups, start, start + rows))
+
+        self.batches.append(program_batch(columns, file_id, game_id, self.vocabulary))
+        return None
+
+    def flush(self) -> None:
+        """Write the buffered programs of the current game as one row group."""
+
+        if not self.batches:
+            return None
+
+        table = pa.Table.from_batches(self.batches, schema=SCHEMA).unify_dictionaries()
+        self.writer.write_table(table, row_group_size=table.num_rows)
+        self.rows += table.num_rows
+        self.row_groups += 1
+        self.written_games.add(self.game_id)
+        self.batches = []
+        return None
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+        TokenDatasetIndex(self.index).write(self.path)
+        return None
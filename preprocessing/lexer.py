@@ -1,24 +1,31 @@
-import difflib
-import struct
+import re
 import sys
+from itertools import islice
 from pathlib import Path
+from string import ascii_lowercase
 from typing import Generator
 
-import pandas as pd
 from rich import print, traceback
-from tagset import TAGSET
 
-from preprocessing.basics import BASICFile, BASICToken
+from preprocessing.basics import BASICFile, BASICToken, TokenBuffer
 from preprocessing.petscii import (
-    ASCII_CODES,
     ASSEMBLY_CHARS,
+    BYTE_CLASSES,
     BYTE_TO_CMD,
     BYTE_TO_CTRL,
+    DIGIT,
+    KEYWORD,
+    LETTER,
+    PETSCII_CODEC,
+    SIGIL,
+    WHITESPACE,
 )
+from preprocessing.prg import LineIndex, open_prg, read_lines, split_lines
 from preprocessing.tagger import Tagger
 
 
 traceback.install()
+
 """ Current problems:
 - number -.1 is split into "-" and ".1"
 - invalid files: inv-mc, spukhaus2, 
@@ -28,49 +35,97 @@ traceback.install()
 - ? zu PRINT
 
 Pipeline: Detokeniser -> Lexer -> Chunker -> Tagger
-PETSCII codec!
 """
 
 
-def show_file_diffs(file1: str, file2: str) -> None:
-    with open(file1, "r") as file:
-        tokenized = [line.lower() for line in file.readlines()]
-
-    with open(file2, "r") as file:
-        ground_truth = [line.lower() for line in file.readlines()]
-
-    for file in (tokenized, ground_truth):
-        for i, line in enumerate(file):
-            while " " in line:
-                line = line.replace(" ", "")
-
-            file[i] = line
-
-    diff = difflib.unified_diff(ground_truth, tokenized)
-    for line in diff:
-        print(line)
-
-    return None
-
-
-def create_parquet(df: pd.DataFrame) -> None:
-    metadata_df = pd.read_excel(
-        "/Users/julian/Documents/3 - Bildung/31 - Studium/314 Universität Stuttgart/314.2 Semester 2/Projektarbeit/corpus/metadata.xlsx"
-    )
+LEXER_VERSION = 1  # increase whenever a change alters the lexer output, it is the salt of the LexerCache keys
+
+# byte classes of the lexer state machine
+N_CLASSES = 17
+(
+    C_CTRL,
+    C_SPACE,
+    C_LETTER,
+    C_DIGIT,
+    C_DOT,
+    C_QUOTE,
+    C_SIGIL,
+    C_PAREN,
+    C_ASCII,
+    C_COMMAND,
+    C_INVALID,  # command byte without a tag
+    C_GREATER,
+    C_EQUAL,
+    C_LESS,
+    C_DATA,
+    C_REM,
+    C_PRINT,
+) = range(N_CLASSES)
+
+# states of the lexer state machine, named after the last lexed byte
+N_STATES = 11
+(
+    S_START,  # no token in the line yet
+    S_OTHER,
+    S_LETTER,
+    S_DIGIT,
+    S_DOT,
+    S_GREATER,
+    S_EQUAL,
+    S_LESS,
+    S_IDENT_LETTER,  # the S_IDENT states are inside a variable name
+    S_IDENT_DIGIT,
+    S_IDENT_OTHER,
+) = range(N_STATES)
+
+# token boundaries, INHERIT repeats the boundary of the previous byte
+NEW, MERGE, INHERIT, SKIP = range(4)
+
+# effects of a transition on the tags of the tokens
+(
+    E_NONE,
+    E_IDENT,
+    E_IDENT_CTRL,
+    E_IDENT_SIGIL,
+    E_SIGIL,
+    E_ARRAY,
+    E_REAL,
+    E_EQUAL,
+    E_DATA,
+    E_PRINT,
+    E_STRING,  # string & comment literals are decoded as a whole with the PETSCII codec
+    E_COMMENT,
+    E_INVALID,
+) = range(13)
+
+# line modes, each mode has its own transition table
+DATA_MODE = 0x01
+PRINT_MODE = 0x02
+
+ALPHA = frozenset(ascii_lowercase)
+REM = b"\x8f"
+# searched on the line buffer itself, so literals are found without copying the line
+QUOTE_PATTERN = re.compile(b'"')
+REM_PATTERN = re.compile(REM + b"*")
+
+
+def _build_code_texts() -> tuple:
+    """Build the decoded token of each byte value outside of string and comment literals."""
+
+    code_texts = []
+    for value in range(256):
+        byte = bytes([value])
+        if value < 0x20:
+            code_texts.append(BYTE_TO_CTRL.get(byte, byte))
+        elif value < 0x80:
+            code_texts.append(chr(value).lower())
+        else:
+            code_texts.append(BYTE_TO_CMD.get(byte, f"0x{value:02x}"))
 
-    # Merge file_id and game_id from metadata_df into df based on the 'name' column
-    df = df.merge(
-        metadata_df[["name", "file_id", "game_id"]],
-        on="name",
-        how="left",
-    )
+    return tuple(code_texts)
 
-    df = df[["file_id", "game_id", "name", "line", "token_id", "bytes", "token", "syntax", "language"]]
-    df = df.sort_values(by=["game_id", "name", "line", "token_id"])
-    df.reset_index(drop=True)
 
-    df.to_parquet(table_path / "tokenized_dataset.parquet", index=False)
-    return None
+CODE_TEXTS = _build_code_texts()
 
 
 class Lexer:
@@ -81,9 +136,36 @@ class Lexer:
         self.tagset = tagset
 
         self.filename = None
-        self.asciiCodes = {char: key for key, value in ASCII_CODES.items() for char in value}
-
-    def detokenize_basic_file(self, filename: str | Path) -> BASICFile:
+        self.buffer: TokenBuffer = None
+
+        # the lexer rules compiled into a state machine
+        self.byte_classes = self._compile_byte_classes()
+        self.transitions = [self._compile_transitions(mode) for mode in range((DATA_MODE | PRINT_MODE) + 1)]
+
+        tag_ids = self.tagger.tag_ids
+        self.system_tags = {
+            name: tag_ids[tagset["system"][system_var]["tag"]]
+            for name, system_var in (("st", "IO"), ("status", "IO"), ("ti$", "time"), ("time$", "time"))
+        }
+        self.time_tag = tag_ids[tagset["system"]["time"]["tag"]]
+        self.string_var_tag = tag_ids[tagset["variables"]["string"]["tag"]]
+        self.integer_var_tag = tag_ids[tagset["variables"]["integer"]["tag"]]
+        self.array_tags = {
+            tag_ids[tagging["tag"]]: tag_ids[f"VA{tagging['tag'][-1]}"] for tagging in tagset["variables"].values()
+        }
+        self.real_tag = tag_ids[tagset["numbers"]["real"]["tag"]]
+        self.other_tag = tag_ids[tagset["punctuations"]["other"]["tag"]]
+        self.assignment_tag = tag_ids[tagset["operators"]["assignment"]["tag"]]
+        self.relational_tag = tag_ids[self.tagger.command_tags[0xB2]]
+        self.unary_tag = tag_ids[tagset["operators"]["unary"]["tag"]]
+        self.comment_tag = tag_ids[tagset["strings"]["comment"]["tag"]]
+
+    def detokenize_basic_file(
+        self,
+        filename: str | Path,
+        lines_inbetween: tuple[int, int] = (0, 99_999),
+        index: LineIndex | None = None,
+    ) -> BASICFile:
         """Detokenizes a BASIC file from the given filename.
 
         This method reads a tokenized BASIC file, processes each line within a specified range,
@@ -91,6 +173,9 @@ class Lexer:
 
         Args:
             filename (str | Path): The path to the tokenized BASIC file to be detokenized.
+            lines_inbetween (tuple[int, int]): The first and last line number to detokenize.
+            index (LineIndex | None): The line index of the file. If given, only the lines in the range are read
+                from the file instead of walking it from the start.
 
         Returns:
             BASICFile: An object containing the detokenized lines of the BASIC file.
@@ -98,10 +183,38 @@ class Lexer:
 
         self.filename = filename
 
-        bfile = BASICFile()
-        lines_inbetween = (0, 99_999)
+        if index is not None:
+            bfile = BASICFile(self.tagger.tags)
+            self.buffer = bfile.buffer
+
+            for ln, txt in read_lines(filename, index, *lines_inbetween):
+                bfile.add_line(self._lex_line(ln, txt), ln)
+            return bfile
+
+        with open_prg(filename) as data:
+            return self.detokenize_buffer(data, lines_inbetween)
+
+    def detokenize_buffer(
+        self,
+        data: bytes | memoryview,
+        lines_inbetween: tuple[int, int] = (0, 99_999),
+    ) -> BASICFile:
+        """Detokenizes a BASIC program held in memory, e.g. a view of a memory-mapped file.
 
-        for ln, txt in self._detokenize_line():
+        The lines are passed to the lexer as zero-copy slices of `data`.
+
+        Args:
+            data (bytes | memoryview): The content of the tokenized BASIC file.
+            lines_inbetween (tuple[int, int]): The first and last line number to detokenize.
+
+        Returns:
+            BASICFile: An object containing the detokenized lines of the BASIC file.
+        """
+
+        bfile = BASICFile(self.tagger.tags)
+        self.buffer = bfile.buffer
+
+        for ln, txt in self._detokenize_line(data):
             if lines_inbetween[0] <= ln <= lines_inbetween[1]:
                 detokenized_line = self._lex_line(ln, txt)
                 bfile.add_line(detokenized_line, ln)
@@ -113,268 +226,309 @@ class Lexer:
 
         return bfile
 
-    def _detokenize_line(self) -> Generator[tuple[int, bytes], None, None]:
+    def _detokenize_line(self, data: bytes | memoryview) -> Generator[tuple[int, memoryview], None, None]:
         """Parse a tokenized Commodore-BASIC source file into (lineno, content bytes) tuples.
 
         Assumption:
         - first 2 bytes are header (skip)
         - each line: 2-byte little-endian line number,
-                    two-byte pointer to next line?
+                    two-byte pointer to next line,
                     tokenized text ending in 0x00,
         """
 
-        with open(self.filename, "rb") as f:
-            data = f.read()
-
-        text = ""
-        pos = 2  # skip header
-        end = len(data)
-        while pos < end - 4:
-            # pointer
-            (ptr,) = struct.unpack_from("<H", data, pos)
-            pos += 2
-
-            # read line number
-            (lineno,) = struct.unpack_from("<H", data, pos)
-            pos += 2
-
-            if lineno == 0 and set(data[pos:]) == {0}:  # rest of file contains only zero bytes
-                return None
-
-            # read text until the 0x00 terminator
-            try:
-                eol = data.index(0x00, pos)
-            except ValueError:
-                print(f"No EOL 0x00 found after byte {pos}, assuming EOF")
-                eol = len(data)
-                return None
-
-            text = data[pos:eol]
-            pos = eol + 1  # skip the 0x00
-
-            yield (lineno, text)
+        view = memoryview(data)
+        linenos, offsets = split_lines(view)
+        for lineno, (start, end) in zip(linenos.tolist(), offsets.tolist(), strict=True):
+            yield (lineno, view[start:end])
 
         return None
 
-    def _lex_line(self, lineno: int, line: bytes) -> list[BASICToken]:
-        if len(line) == 1:
-            hexbytes: list[int] = [line[0]]
-        else:
-            hexbytes: list[int] = list(line)  # [x for x in line]
-
-        self.comment_cmd = False
-        self.print_cmd = False
-        self.string_decl = False
-        self.is_data_block = False
-        self.parenthesis = 0
-        self.last_char: BASICToken = None
-        self.append_btoken = True
-        self.decoded_tokens: list[BASICToken] = []
-
-        for value in hexbytes:
-            btoken = BASICToken(value, lineno)
-
-            if btoken.is_whitespace() and not self._within_string_like_expression():
-                continue
-
-            if self.string_decl:
-                self._decode_string(btoken)
-
-            elif self.comment_cmd:
-                self._decode_comment_statement(btoken)
+    def _compile_byte_classes(self) -> bytes:
+        """Map each byte value to its byte class of the state machine."""
+
+        byte_classes = bytearray(256)
+        for value, byte_class in enumerate(BYTE_CLASSES):
+            if value < 0x20:
+                byte_classes[value] = C_CTRL
+            elif byte_class & WHITESPACE:
+                byte_classes[value] = C_SPACE
+            elif byte_class & LETTER:
+                byte_classes[value] = C_LETTER
+            elif byte_class & DIGIT:
+                byte_classes[value] = C_DIGIT
+            elif byte_class & SIGIL:
+                byte_classes[value] = C_SIGIL
+            elif byte_class & KEYWORD:
+                byte_classes[value] = C_INVALID if self.tagger.command_tags[value] is None else C_COMMAND
+            else:
+                byte_classes[value] = C_ASCII
 
-            elif value < 0x20:
-                # ASCII control char outside of print statement, unclear why
-                btoken.token = BYTE_TO_CTRL.get(btoken.byte, btoken.byte)
-                btoken.syntax = self.tagger.parse_string(btoken)
+        for char, byte_class in ((".", C_DOT), ('"', C_QUOTE), ("(", C_PAREN)):
+            byte_classes[ord(char)] = byte_class
+        for value, byte_class in ((0xB1, C_GREATER), (0xB2, C_EQUAL), (0xB3, C_LESS), (0x83, C_DATA), (0x8F, C_REM)):
+            byte_classes[value] = byte_class
+        for value in (0x98, 0x99):  # PRINT & PRINT#
+            byte_classes[value] = C_PRINT
 
-                if self.string_decl:
-                    self.append_btoken = False
+        return bytes(byte_classes)
 
-            elif 0x20 <= value <= 0x7F:
-                # value is an ASCII printable character
-                self._decode_ascii(btoken)
+    def _compile_transitions(self, mode: int) -> list[list[tuple]]:
+        """Compile the lexer rules of a line mode into a transition table indexed by state and byte class.
 
-            elif value >= 0x80:
-                # BASIC command statement
-                self._decode_cmd(btoken)
+        Each transition is a tuple (boundary, next state, effect, decoded tokens, tag ids), the decoded token and the
+        default tag of a byte are looked up by its value.
 
-            else:
-                btoken.token = btoken.byte
-                btoken.syntax = "?_unknown"
-                self.append_btoken = True
+        Args:
+            mode (int): The line mode, a combination of DATA_MODE and PRINT_MODE.
 
-            self._disambiguate_unary_signs()
+        Returns:
+            list[list[tuple]]: The transitions of each state and byte class.
+        """
 
-            if self.append_btoken:
-                self.decoded_tokens.append(btoken)
+        tag_ids = self.tagger.tag_ids
+        string_tag = tag_ids[self.tagset["strings"]["string"]["tag"]]
+
+        code_tags = [string_tag] * 256  # control chars outside of a string are tagged as string
+        for value in range(0x20, 0x100):
+            tag = self.tagger.ascii_tags[value] if value < 0x80 else self.tagger.command_tags[value]
+            code_tags[value] = tag_ids.get(tag, 0)
+        code_tags[ord('"')] = string_tag
+        if mode & DATA_MODE:
+            for value in range(0x20, 0x80):
+                if value != ord(","):
+                    code_tags[value] = tag_ids[self.tagset["data"]["tag"]]
+
+        return [
+            [
+                (boundary, next_state, effect, CODE_TEXTS, code_tags)
+                for boundary, next_state, effect in self._code_transitions(state, mode)
+            ]
+            for state in range(N_STATES)
+        ]
+
+    def _code_transitions(self, state: int, mode: int) -> list[tuple[int, int, int]]:
+        """Return the (boundary, next state, effect) of each byte class in a state of the state machine."""
+
+        is_ident = state in (S_IDENT_LETTER, S_IDENT_DIGIT, S_IDENT_OTHER)
+        row = [(NEW, S_OTHER, E_NONE)] * N_CLASSES
+
+        # control chars continue the token boundary of the previous byte
+        row[C_CTRL] = (INHERIT, S_IDENT_OTHER, E_IDENT_CTRL) if is_ident else (INHERIT, S_OTHER, E_NONE)
+        row[C_SPACE] = (NEW, S_OTHER, E_NONE) if mode & PRINT_MODE else (SKIP, state, E_NONE)
+
+        # v, a -> va (variable)
+        if state in (S_LETTER, S_IDENT_LETTER):
+            row[C_LETTER] = (MERGE, state, E_IDENT if is_ident else E_NONE)
+        else:
+            row[C_LETTER] = (NEW, S_LETTER if mode & DATA_MODE else S_IDENT_LETTER, E_NONE)
+
+        # 1, 2 -> 12 (number), v, 1 -> v1 (variable), 1, . -> 1. and ., 5 -> .5 (real number)
+        if state in (S_LETTER, S_DIGIT):
+            row[C_DIGIT] = (MERGE, S_DIGIT, E_NONE)
+        elif state in (S_IDENT_LETTER, S_IDENT_DIGIT):
+            row[C_DIGIT] = (MERGE, S_IDENT_DIGIT, E_NONE)
+        elif state == S_DOT:
+            row[C_DIGIT] = (MERGE, S_DIGIT, E_REAL)
+        else:
+            row[C_DIGIT] = (NEW, S_DIGIT, E_NONE)
+        row[C_DOT] = (MERGE, S_DOT, E_REAL) if state in (S_DIGIT, S_IDENT_DIGIT, S_DOT) else (NEW, S_DOT, E_NONE)
+
+        # v, $ -> v$ (variable)
+        row[C_SIGIL] = (MERGE, S_IDENT_OTHER, E_IDENT_SIGIL) if is_ident else (NEW, S_OTHER, E_SIGIL)
+        row[C_PAREN] = (NEW, S_OTHER, E_ARRAY if is_ident else E_NONE)
+        row[C_QUOTE] = (NEW, S_OTHER, E_STRING)
+
+        # 2-byte relational operators like <=, >=, <>, =>, =<
+        relational_states = {C_GREATER: S_GREATER, C_EQUAL: S_EQUAL, C_LESS: S_LESS}
+        for byte_class, next_state in relational_states.items():
+            if state in relational_states.values() and state != next_state:
+                row[byte_class] = (MERGE, next_state, E_NONE)
             else:
-                if self.decoded_tokens:
-                    self.decoded_tokens[-1] += btoken
-                else:
-                    self.decoded_tokens.append(btoken)
+                row[byte_class] = (NEW, next_state, E_EQUAL if byte_class == C_EQUAL and state != S_START else E_NONE)
 
-            # self.last_char = btoken
-            self.last_char = self.decoded_tokens[-1]
-            self._check_for_system_var()
+        row[C_DATA] = (NEW, S_OTHER, E_DATA if state == S_START else E_NONE)
+        row[C_REM] = (NEW, S_OTHER, E_COMMENT)
+        row[C_PRINT] = (NEW, S_OTHER, E_PRINT)
+        row[C_INVALID] = (NEW, S_OTHER, E_INVALID)
+        return row
 
-        self._check_line_language()
+    def _lex_line(self, lineno: int, line: bytes | memoryview) -> list[BASICToken]:
+        """Lex the bytes of one line into tokens in a single pass over the transition table.
 
-        return self.decoded_tokens
+        The transition of the current state and byte class decides if the byte starts a new token or extends the
+        last one, its default tag and the next state. The few rules that need to look at the previous token are
+        applied as effects of the transition, rules that need the whole line are applied afterwards by
+        `_apply_fixups`. String and comment literals are not lexed byte by byte, they are decoded as a whole with
+        the PETSCII codec.
 
-    def _decode_cmd(self, btoken: BASICToken) -> None:
-        self.append_btoken = True
+        Args:
+            lineno (int): The BASIC line number.
+            line (bytes | memoryview): The tokenized text of the line.
 
-        if (
-            btoken.value in (0xB1, 0xB2, 0xB3)
-            and self.last_char.value in (0xB1, 0xB2, 0xB3)
-            and btoken.value != self.last_char.value
-        ):
-            # 2-byte relational operator like <=, >=, <>, =>, =<
-            self.append_btoken = False
+        Returns:
+            list[BASICToken]: The tokens of the line.
+        """
 
-        elif btoken.value == 0x83 and not self.decoded_tokens:
-            self.is_data_block = True
+        buffer = self.buffer
+        tokens = buffer.tokens
+        tags = buffer.tag
+        byte_classes = self.byte_classes
+        first = len(tokens)
 
-        self.print_cmd = btoken.value in (0x98, 0x99) if not self.print_cmd else self.print_cmd  # PRINT & PRINT#
-        self.comment_cmd = btoken.value in (0x8F,)  # REM
+        mode = 0
+        transitions = self.transitions[mode]
+        state = S_START
+        merge = False
+        reserved: dict[int, int] = {}  # token index -> tag id of system variables
+        equal_signs: list[int] = []
 
-        if self.string_decl:
-            btoken.token = BYTE_TO_CTRL.get(btoken.byte, btoken.byte)
-            btoken.syntax = self.tagger.parse_string(btoken)
-            self.append_btoken = False
-        else:
-            btoken.token = BYTE_TO_CMD[btoken.byte]
-            btoken.syntax = self.tagger.parse_command(btoken)
+        positions = enumerate(line)
+        for pos, value in positions:
+            boundary, next_state, effect, texts, default_tags = transitions[state][byte_classes[value]]
 
-            # disambiguate equal sign
-            if btoken.value == 0xB2 and self.decoded_tokens:
-                self._disambiguate_equal_sign(btoken)
+            if boundary == SKIP:
+                continue
+            elif boundary != INHERIT:
+                merge = boundary == MERGE
 
-        return None
+            if merge:
+                buffer.extend_last(value, texts[value])
+            else:
+                buffer.add(value, lineno, texts[value], default_tags[value])
+            state = next_state
 
-    def _decode_string(self, btoken: BASICToken) -> None:
-        # BASIC commands are not available in a string
-        if btoken.byte == b'"':
-            # first ", start of print statement
-            self.parenthesis += 1
-            btoken.token = '"'
-            self.append_btoken = True
-
-            if self.parenthesis == 2:
-                # second ", end of print statement
-                self.parenthesis = 0
-                self.append_btoken = False
-                self.string_decl = False
-
-        elif self.parenthesis == 0:
-            # no <"> after PRINT, expect variable or command
-            self.append_btoken = True
-
-            if btoken.value < 0x20:
-                # ASCII control char outside of print statement, unclear why
-                btoken.token = BYTE_TO_CTRL.get(btoken.byte, btoken.byte)
-                btoken.syntax = self.tagger.parse_string(btoken)
-
-            elif 0x20 <= btoken.value <= 0x7F:
-                # btoken.value is an ASCII printable character
-                self._decode_ascii(btoken)
-
-            elif btoken.value >= 0x80:
-                # BASIC command statement
-                self._decode_cmd(btoken)
+            if not effect:
+                continue
 
-            else:
-                btoken.token = btoken.byte
-                btoken.syntax = "?_unknown"
+            index = len(tokens) - 1
+            if effect == E_IDENT_CTRL:
+                if not merge:
+                    state = S_OTHER
+
+            elif effect == E_IDENT:
+                if tokens[index] in self.system_tags:
+                    reserved[index] = self.system_tags[tokens[index]]
+                    state = S_LETTER
+
+            elif effect == E_IDENT_SIGIL:
+                tags[index] = self.string_var_tag if value == ord("$") else self.integer_var_tag
+                if tokens[index] in self.system_tags:
+                    reserved[index] = self.system_tags[tokens[index]]
+                    state = S_OTHER
+
+            elif effect == E_SIGIL:
+                if index > first and tokens[index - 1][:1].lower() in ALPHA:
+                    # the sigil types the previous name, e.g. a command name used as a variable
+                    tags[index - 1] = self.string_var_tag if value == ord("$") else self.integer_var_tag
+                    reserved.pop(index - 1, None)
+                elif not mode & DATA_MODE:
+                    tags[index] = self.other_tag
+
+            elif effect == E_ARRAY:
+                # disambiguate parenthesis, could hint at an array variable
+                tags[index - 1] = self.array_tags[tags[index - 1]]
+
+            elif effect == E_REAL:
+                tags[index] = self.real_tag
+                reserved.pop(index, None)
+
+            elif effect == E_EQUAL:
+                equal_signs.append(index)
+
+            elif effect in (E_DATA, E_PRINT):
+                mode |= DATA_MODE if effect == E_DATA else PRINT_MODE
+                transitions = self.transitions[mode]
+
+            elif effect == E_STRING:
+                # the literal ends with the closing quote or at the end of the line
+                quote = QUOTE_PATTERN.search(line, pos + 1)
+                end = quote.end() if quote else len(line)
+                if end > pos + 1:
+                    literal = bytes(line[pos + 1 : end])
+                    buffer.extend_last_bytes(literal, self._decode_string(lineno, literal))
+                    merge = True
+                    next(islice(positions, len(literal), len(literal)), None)  # skip the bytes of the literal
+
+            elif effect == E_COMMENT:
+                # the comment runs to the end of the line, each 0x8F byte right after the REM is a token on its own
+                start = REM_PATTERN.match(line, pos + 1).end()
+                for _ in range(start - pos - 1):
+                    buffer.add(REM[0], lineno, REM.decode(PETSCII_CODEC, errors="replace"), self.comment_tag)
+                if start < len(line):
+                    text = bytes(line[start:])
+                    buffer.add_bytes(text, lineno, text.decode(PETSCII_CODEC, errors="replace"), self.comment_tag)
+                break
 
-        else:
-            # anything in between "" in the print statement
-            btoken.token = BYTE_TO_CTRL.get(btoken.byte, btoken.byte.decode("ascii", errors="replace").lower())
-            if btoken.value > 0x80 and btoken.byte not in BYTE_TO_CTRL:
-                # add those to the BYTE_TO_CTRL dict
-                print(btoken, btoken.lineno, [b.token for b in self.decoded_tokens])
-            self.append_btoken = False
-
-            btoken.syntax = self.tagset["strings"]["string"]["tag"]
-        return None
+            elif effect == E_INVALID:
+                msg = f"can not parse command btoken of token {tokens[index]}"
+                raise ValueError(msg)
 
-    def _decode_comment_statement(self, btoken: BASICToken) -> None:
-        btoken.syntax = self.tagset["strings"]["comment"]["tag"]
-        if btoken.value < 0x20:
-            btoken.token = BYTE_TO_CTRL.get(btoken.byte, btoken.byte)
-        elif btoken.value < 0x80:
-            btoken.token = btoken.byte.decode("ascii", errors="replace").lower()
-        else:
-            btoken.token = BYTE_TO_CTRL.get(btoken.byte, btoken.byte.decode("ascii", errors="replace"))
+        self._apply_fixups(first, reserved, equal_signs)
 
-        if self.last_char.value not in (0x8F,):
-            # a comment where at least one char was placed already
-            self.append_btoken = False
+        decoded_tokens = [BASICToken(buffer, index) for index in range(first, len(tokens))]
+        self._check_line_language(decoded_tokens)
 
-        return None
+        return decoded_tokens
 
-    def _decode_ascii(self, btoken: BASICToken) -> None:
-        btoken.token = chr(btoken.value).lower()
+    def _decode_string(self, lineno: int, literal: bytes) -> str:
+        """Decode the bytes of a string literal, bytes without a text are replaced and reported."""
 
-        btoken.syntax = self.tagger.parse_ascii(btoken, self.decoded_tokens)
+        try:
+            return literal.decode(PETSCII_CODEC)
+        except UnicodeDecodeError as error:
+            # add those to the BYTE_TO_CTRL dict
+            print(f"unknown string byte 0x{literal[error.start]:02x} in line {lineno}", self.buffer.tokens[-1])
+            return literal.decode(PETSCII_CODEC, errors="replace")
 
-        if self._belongs_to_previous_byte(btoken):
-            # assumption: either multi-char var name or multi-digit number
-            self.append_btoken = False
-        else:
-            self.append_btoken = True
-
-        if btoken.byte == b'"':
-            self.parenthesis += 1
-            self.string_decl = True
-
-            if self.parenthesis == 2:
-                self.string_decl = False
-                self.parenthesis = 0
-
-        if self.string_decl:
-            btoken.syntax = self.tagger.parse_string(btoken)
-        elif btoken.is_digit() or btoken.token == ".":
-            self._disambiguate_dot(btoken)
-
-        elif btoken.is_sigil():
-            if self.decoded_tokens and self.decoded_tokens[-1].is_alpha():
-                if btoken.token == "$":
-                    self.decoded_tokens[-1].syntax = self.tagset["variables"]["string"]["tag"]
-                else:
-                    self.decoded_tokens[-1].syntax = self.tagset["variables"]["integer"]["tag"]
-            else:
-                btoken.syntax = self.tagset["punctuations"]["other"]["tag"]
+    def _apply_fixups(self, first: int, reserved: dict[int, int], equal_signs: list[int]) -> None:
+        """Apply the context-sensitive tags of a lexed line, starting with the token at index `first`.
 
-        elif btoken.token == "(" and self.decoded_tokens and self.decoded_tokens[-1].syntax.startswith("V"):
-            # disambiguate parenthesis, could hint at an array variable
-            self.decoded_tokens[-1].syntax = f"VA{self.decoded_tokens[-1].syntax[-1]}"
+        Args:
+            first (int): The buffer index of the first token of the line.
+            reserved (dict[int, int]): The tag ids of the tokens that are named like a system variable.
+            equal_signs (list[int]): The buffer indices of the "=" tokens that are not the first token of the line.
+        """
 
-        # if self.is_data_block and btoken.is_letter():
-        if self.is_data_block and btoken.token != ",":
-            btoken.syntax = self.tagset["data"]["tag"]
-        return None
+        buffer = self.buffer
+        tokens = buffer.tokens
+        tags = buffer.tag
+        end = len(tokens)
+
+        # system variables, ti & time are checked once another token follows
+        for index, tag in reserved.items():
+            tags[index] = tag
+        for index in range(first + 1, end - 1):
+            if tokens[index] in ("ti", "time"):
+                tags[index] = self.time_tag
+
+        # disambiguate equal sign, relational if an "IF" precedes it in the same command span
+        for index in equal_signs:
+            tags[index] = self.assignment_tag
+            for prior_index in range(index - 1, first - 1, -1):
+                if tokens[prior_index] == "IF":
+                    tags[index] = self.relational_tag
+                    break
+                elif tokens[prior_index] in (":", ";", "THEN"):
+                    # end of command span, since "IF" was not found it is an assignment
+                    break
+
+        # unary signs, a "+" or "-" that is not preceded by a variable, number, string or closing parenthesis
+        for index in range(first, end):
+            if tokens[index][:1] not in ("+", "-") or (index == end - 1 and buffer.length[index] == 1):
+                continue
 
-    def _belongs_to_previous_byte(self, btoken: BASICToken) -> bool:
-        if self.last_char is None:
-            return False
-        elif (
-            (btoken.is_letter() and self.last_char.is_letter())  # v, a -> va  (variable)
-            or (btoken.is_digit() and self.last_char.is_digit())  # 1, 2 -> 12  (number)
-            or (btoken.is_digit() and self.last_char.is_letter())  # v, 1 -> v2  (variable)
-            or self.string_decl  # "hell, o -> "hello (string literal)
-            or (btoken.is_sigil() and self.last_char.syntax.startswith("V"))  # v, $ -> v$  (variable)
-        ):
-            return True
+            if index == first:
+                tags[index] = self.unary_tag
+                continue
 
-        return False
+            syntax = buffer.tags[tags[index - 1]] or ""
+            if not (syntax.startswith(("V", "N", "S")) or tokens[index - 1] == ")"):
+                tags[index] = self.unary_tag
 
-    def _within_string_like_expression(self) -> bool:
-        return any([self.print_cmd, self.comment_cmd, self.string_decl])
+        return None
 
-    def _check_line_language(self) -> None:
-        tokenized_line = [b.token for b in self.decoded_tokens]
+    def _check_line_language(self, decoded_tokens: list[BASICToken]) -> None:
+        tokenized_line = [b.token for b in decoded_tokens]
         if (
             tokenized_line
             and tokenized_line[0].lower() == "data"
@@ -382,113 +536,7 @@ class Lexer:
                 (char in ASSEMBLY_CHARS for token in tokenized_line[1:] for char in token),
             )
         ):
-            for b in self.decoded_tokens:
+            for b in decoded_tokens:
                 b.language = "ASSEMBLY"
 
         return None
-
-    def _disambiguate_unary_signs(self) -> None:
-        last = self.last_char
-        tokens = self.decoded_tokens
-
-        # only care when last token is a “+” or “–”
-        if last and last.token in ("+", "-"):
-            # are we the very first token on the line?
-            is_first = len(tokens) == 1
-
-            # or did the token before last *not* look like an expression?
-            # i.e. not a variable (V...), not a number (N...), and not a closing ')'
-            prev = tokens[-2]
-            syntax = prev.syntax or ""
-            is_nonexpr = not (syntax.startswith(("V", "N", "S")) or prev.token == ")")
-
-            if is_first or is_nonexpr:
-                # it’s a unary sign, so re-tag as part of the literal
-                tokens[-1].syntax = self.tagset["operators"]["unary"]["tag"]
-                # self.append_btoken = False  # for now separate unary sign
-
-        return None
-
-    def _disambiguate_dot(self, btoken: BASICToken) -> None:
-        """Add the current token to the previous token if the current token is a dot and
-        the previous token was a digit or the current token is a digit and the previous token was a dot.
-        """
-
-        if self.last_char is not None and (
-            (btoken.token == "." and self.last_char.is_digit()) or self.last_char.token[-1] == "."
-        ):
-            btoken.syntax = self.tagset["numbers"]["real"]["tag"]
-            self.decoded_tokens[-1].syntax = btoken.syntax
-            self.append_btoken = False
-
-        return None
-
-    def _disambiguate_equal_sign(self, btoken: BASICToken) -> None:
-        btoken.syntax = self.tagset["operators"]["assignment"]["tag"]
-
-        for prior_token in self.decoded_tokens[::-1]:
-            if prior_token.token == "IF":
-                # relational equal sign
-                btoken.syntax = self.tagger.parse_command(btoken)
-                break
-            elif prior_token.token in (":", ";", "THEN"):
-                # end of command span, since "IF" was not found it is an assignment
-                break
-
-    def _check_for_system_var(self) -> None:
-        last_token = self.decoded_tokens[-1]
-        if last_token.syntax and last_token.syntax.startswith("V"):
-            if last_token.token.lower() in ("ti$", "time$"):
-                self.decoded_tokens[-1].syntax = self.tagset["system"]["time"]["tag"]
-
-            elif last_token.token.lower() in ("st", "status"):
-                self.decoded_tokens[-1].syntax = self.tagset["system"]["IO"]["tag"]
-
-        elif len(self.decoded_tokens) > 2 and self.decoded_tokens[-2].token.lower() in ("ti", "time"):
-            self.decoded_tokens[-2].syntax = self.tagset["system"]["time"]["tag"]
-
-        return None
-
-
-if __name__ == "__main__":
-    corpus_path = Path(
-        "/Users/julian/Documents/3 - Bildung/31 - Studium/314 Universität Stuttgart/314.2 Semester 2/Projektarbeit/corpus"
-    )
-    source_path = corpus_path / "encoded"
-    petcat_path = corpus_path / "decoded" / "petcat"
-    dest_path = corpus_path / "decoded" / "tokenizer"
-    table_path = corpus_path / "dataset"
-
-    df = pd.DataFrame()
-
-    detokenizer = Lexer(TAGSET)
-
-    for disk in ("Homecomp1", "Homecomp2", "Homecomp3"):
-        for source_file in (source_path / disk).iterdir():
-            if source_file.name in (".DS_Store", "inv-mc", "spukhaus2"):
-                continue
-
-            # if source_file.name not in ("computer blues"):
-            #     continue
-            print(source_file.name)
-
-            # sourceFile = sourcePath / 'Homecomp1' / game
-            petcat_file = petcat_path / source_file.parent.name / f"{source_file.name}.bas"
-            dest_file = dest_path / source_file.parent.name / f"{source_file.name}.bas"
-            table_file = table_path / source_file.parent.name / f"{source_file.name}.xlsx"
-            dest_file.parent.mkdir(exist_ok=True)
-            table_file.parent.mkdir(exist_ok=True)
-
-            bfile = detokenizer.detokenize_basic_file(source_file)
-
-            # bfile.save_file(dest_file)
-            table = bfile.save_table(table_file)
-
-            table.insert(0, "name", source_file.name)
-            df = table if df.empty else pd.concat((df, table), axis=0)
-            # break
-
-    print(df)
-    create_parquet(df)
-    # print()
-    # showFileDiffs(petcatFile, destFile)
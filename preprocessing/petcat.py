@@ -1,49 +1,177 @@
-"""The script extracts & converts d64 files into readable txt files using petcat."""
+"""The script extracts & converts d64 files into readable txt files, in-process or using petcat."""
 
 import os
 import shutil
 import subprocess
+import tempfile
+import warnings
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
 
+from preprocessing.d64 import read_programs
+from preprocessing.petscii import BYTE_TO_CMD, BYTE_TO_CTRL
+from preprocessing.prg import open_prg, split_lines
 
-def extractD64Files(vice_bin_path: Path, d64_path: Path, extraction_dir: Path) -> None:
-    """Extract all d64 files with c1541 from a source dir to a dest dir.
+
+def _build_listing_tables() -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """Build the listing text of each byte value outside and inside of quotes, like petcat prints them."""
+
+    code, quoted = [], []
+    for value in range(256):
+        byte = bytes([value])
+        ctrl = BYTE_TO_CTRL.get(byte, f"{{${value:02x}}}")
+        if value < 0x20:
+            code.append(ctrl)
+            quoted.append(ctrl)
+        elif value < 0x80:
+            code.append(chr(value).lower())
+            quoted.append(BYTE_TO_CTRL.get(byte, chr(value).lower()))
+        else:
+            code.append(BYTE_TO_CMD[byte].lower() if byte in BYTE_TO_CMD else ctrl)
+            quoted.append(ctrl)
+
+    return tuple(code), tuple(quoted)
+
+
+CODE_LISTING, QUOTED_LISTING = _build_listing_tables()
+
+
+def extractD64Files(d64_path: Path, extraction_dir: Path, *, vice_bin_path: Path | None = None) -> None:
+    """Extract the programs of all d64 files from a source dir to a dest dir.
+
+    The images are read with `read_programs`, without the VICE tool c1541.
 
     Parameters
     ----------
-        vice_bin_path: Path
-            The path to the bin directory of VICE (https://vice-emu.sourceforge.io/).
         d64_path: Path
             The directory of the .d64 files.
         extraction_dir: Path
             The path where the c64 source code files should be stored. A subdirectory for each file is created.
+        vice_bin_path: Path | None
+            Deprecated and ignored, c1541 is not needed anymore.
     """
 
-    c1541_path = vice_bin_path / "c1541"
-    cwd_files = [file for file in Path().iterdir() if file.is_file()]
+    if vice_bin_path is not None:
+        warnings.warn("vice_bin_path is ignored, the d64 files are read without c1541", DeprecationWarning, stacklevel=2)
 
-    for file in d64_path.iterdir():
-        if file.suffix == ".d64":
+    for file in sorted(d64_path.iterdir()):
+        if file.suffix.lower() == ".d64":
             extraction_path = extraction_dir / file.stem
             extraction_path.mkdir(exist_ok=True)
 
-            terminal_cmd = f"{c1541_path} {file} -extract"
-            output = subprocess.run(terminal_cmd, capture_output=True, shell=True)
+            try:
+                for name, data in read_programs(file):
+                    (extraction_path / name).write_bytes(data)
+            except ValueError as error:
+                # a broken image should not stop the extraction of the others
+                print("Error:", error)
+
+    return None
+
+
+class ToolResult(NamedTuple):
+    args: list[str]
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+    files: list[Path]  # files the tool wrote into its working directory, after moving them to the destination
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.stderr
+
+
+def run_tool(args: list[str], destination: Path | None = None) -> ToolResult:
+    """Run a VICE tool in its own temporary working directory.
+
+    Parameters
+    ----------
+        args : list[str]
+            The command, paths must be absolute since the tool does not run in the current working directory.
+        destination : Path | None
+            The directory the files written by the tool are moved to, if None they are discarded.
+
+    Returns
+    -------
+        ToolResult
+            The exit code, the captured output and the moved files of the run.
+    """
+
+    with tempfile.TemporaryDirectory(prefix="vice-") as workdir:
+        try:
+            output = subprocess.run(args, cwd=workdir, capture_output=True, check=False)
+        except OSError as error:
+            # e.g. the tool is not installed, report it like a failed run
+            return ToolResult(args, -1, b"", str(error).encode(), [])
+
+        files = []
+        if destination is not None:
+            for file in sorted(Path(workdir).iterdir()):
+                if file.is_file():
+                    files.append(Path(shutil.move(file, destination / file.name)))
+
+    return ToolResult(args, output.returncode, output.stdout, output.stderr, files)
+
+
+def run_tools(jobs: Iterable[tuple[list[str], Path | None]], max_workers: int | None = None) -> Iterator[ToolResult]:
+    """Run VICE tool jobs concurrently on a bounded thread pool, each job in its own working directory.
+
+    Parameters
+    ----------
+        jobs : Iterable[tuple[list[str], Path | None]]
+            The command and destination directory of each job, see `run_tool`.
+        max_workers : int | None
+            The maximum number of tools running at the same time, defaults to the number of CPUs.
+
+    Yields
+    ------
+        ToolResult
+            The result of each job in the order of `jobs`, a failed job does not stop the others.
+    """
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        yield from executor.map(lambda job: run_tool(*job), jobs)
+
+    return None
+
+
+def extract_d64_files_with_c1541(
+    vice_bin_path: Path, d64_path: Path, extraction_dir: Path, max_workers: int | None = None
+) -> None:
+    """Extract all d64 files with c1541 from a source dir to a dest dir, e.g. images the native reader rejects.
+
+    Parameters
+    ----------
+        vice_bin_path : Path
+            The path to the bin directory of VICE (https://vice-emu.sourceforge.io/).
+        d64_path : Path
+            The directory of the .d64 files.
+        extraction_dir : Path
+            The path where the c64 source code files should be stored. A subdirectory for each file is created.
+        max_workers : int | None
+            The maximum number of c1541 processes running at the same time.
+    """
+
+    c1541_path = vice_bin_path / "c1541"
 
-            # ugly: since c1541 will extract all to cwd, the files must be moved to the correct dir afterwards
-            for extracted_file in Path().iterdir():
-                if extracted_file.is_file() and extracted_file not in cwd_files:
-                    shutil.move(extracted_file, extraction_path / extracted_file.name)
+    jobs = []
+    for file in sorted(d64_path.iterdir()):
+        if file.suffix.lower() == ".d64":
+            extraction_path = extraction_dir / file.stem
+            extraction_path.mkdir(exist_ok=True)
+            jobs.append(([str(c1541_path), str(file.resolve()), "-extract"], extraction_path))
 
-            if output.stderr:
-                print("Error:", output.stderr)
-                print(terminal_cmd)
-                return None
+    for result in run_tools(jobs, max_workers):
+        if not result.ok:
+            print("Error:", result.stderr)
+            print(" ".join(result.args))
 
     return None
 
 
-def convert_d64_files(vice_bin_path: Path, extraction_dir: Path) -> None:
+def convert_d64_files(vice_bin_path: Path, extraction_dir: Path, max_workers: int | None = None) -> None:
     """Convert all files without a suffix (c64 source code) to plain txt files using petcat.
 
     Parameters
@@ -52,36 +180,120 @@ def convert_d64_files(vice_bin_path: Path, extraction_dir: Path) -> None:
             The path to the bin directory of VICE (https://vice-emu.sourceforge.io/).
         extraction_dir : Path
             The path where the c64 source code files are stored.
+        max_workers : int | None
+            The maximum number of petcat processes running at the same time.
     """
 
     petcat_path = vice_bin_path / "petcat"
 
-    for path, dirs, files in extraction_dir.walk():
-        for file in files:
-            file = Path(file)
-            if not (file.suffix or file == ".DS_Store"):
-                filepath = (path / file).resolve()
+    filepaths = [
+        (path / file).resolve()
+        for path, dirs, files in extraction_dir.walk()
+        for file in files
+        if not (Path(file).suffix or file == ".DS_Store")
+    ]
+    jobs = [([str(petcat_path), "-o", str(path.with_suffix(".bas")), "--", str(path)], None) for path in filepaths]
+
+    for filepath, result in zip(filepaths, run_tools(jobs, max_workers), strict=True):
+        if result.ok:
+            filepath.unlink()
+        else:
+            print("Error:", result.stderr)
+            print(" ".join(result.args))
+
+    return None
+
+
+def detokenize_program(data: bytes | memoryview) -> str:
+    """Detokenize a BASIC V2 program into a petcat-compatible listing.
+
+    Each line is printed as its line number and text. Keywords are expanded outside of quotes, control chars and
+    PETSCII graphics are written as {ctrl} codes from BYTE_TO_CTRL. Spaces are kept as they are stored.
+
+    Parameters
+    ----------
+        data : bytes | memoryview
+            The content of the PRG file including the 2-byte load address.
+
+    Returns
+    -------
+        str
+            The listing, one BASIC line per text line.
+    """
+
+    view = memoryview(data)
+    linenos, offsets = split_lines(view)
+
+    lines = []
+    for lineno, (start, end) in zip(linenos.tolist(), offsets.tolist(), strict=True):
+        # every second part of the split is inside of quotes
+        parts = bytes(view[start:end]).decode("latin-1").split('"')
+        parts[0::2] = [part.translate(CODE_LISTING) for part in parts[0::2]]
+        parts[1::2] = [part.translate(QUOTED_LISTING) for part in parts[1::2]]
+        text = '"'.join(parts)
+        lines.append(f"{lineno} {text}")
+
+    return "".join(f"{line}\n" for line in lines)
+
+
+def convert_prg_file(filepath: Path) -> str | None:
+    """Convert one c64 source code file into a .bas listing next to it and delete the source file.
+
+    Parameters
+    ----------
+        filepath : Path
+            The tokenized BASIC file.
+
+    Returns
+    -------
+        str | None
+            The error message if the file could not be converted, None otherwise.
+    """
+
+    try:
+        with open_prg(filepath) as data:
+            listing = detokenize_program(data)
+    except (OSError, ValueError) as error:
+        return f"{filepath}: {error}"
+
+    filepath.with_suffix(".bas").write_text(listing, encoding="utf-8")
+    filepath.unlink()
+    return None
+
+
+def convert_prg_files(extraction_dir: Path, jobs: int | None = None) -> None:
+    """Convert all files without a suffix (c64 source code) to .bas listings in-process, without petcat.
+
+    Parameters
+    ----------
+        extraction_dir : Path
+            The path where the c64 source code files are stored.
+        jobs : int | None
+            The number of worker processes, defaults to the number of CPUs.
+    """
 
-                # conversion
-                terminal_cmd = f'{petcat_path} -o "{filepath.with_suffix(".bas")}" -- "{filepath}"'
+    filepaths = [
+        (path / file).resolve()
+        for path, dirs, files in extraction_dir.walk()
+        for file in files
+        if not (Path(file).suffix or file == ".DS_Store")
+    ]
 
-                output = subprocess.run(terminal_cmd, capture_output=True, shell=True)
-                if not output.stderr:
-                    filepath.unlink()
-                else:
-                    print("Error:", output.stderr)
-                    print(terminal_cmd)
-                    return None
+    jobs = jobs or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunksize = max(1, len(filepaths) // (4 * jobs))
+        for error in executor.map(convert_prg_file, filepaths, chunksize=chunksize):
+            if error is not None:
+                print("Error:", error)
 
     return None
 
 
 if __name__ == "__main__":
-    vice_bin_path = Path("/Applications/vice-arm64-gtk3-3.9/bin")
     d64_path = Path("d64")
     extraction_dir = Path("corpus")
     extraction_dir.mkdir(exist_ok=True)
 
-    extractD64Files(vice_bin_path, d64_path, extraction_dir)
+    extractD64Files(d64_path, extraction_dir)
 
-    convert_d64_files(vice_bin_path, extraction_dir)
+    convert_prg_files(extraction_dir)
@@ -1,5 +1,7 @@
 """The script provides lookup tables for PETSCII bytes."""
 
+import codecs
+import re
 import string
 import sys
 
@@ -216,5 +218,106 @@ ASCII_CODES = {
     "punctuation": [ord(char) for char in punctuations],
 }
 
+# byte classes as bit flags, combined per byte value in BYTE_CLASSES
+LETTER = 0x01
+DIGIT = 0x02
+SIGIL = 0x04
+PUNCTUATION = 0x08
+WHITESPACE = 0x10
+KEYWORD = 0x20  # BASIC command token range 0x80-0xFF
+
+
+def _build_byte_classes() -> bytes:
+    """Build a 256-entry lookup table with the byte class flags of each byte value."""
+
+    table = bytearray(256)
+    for flag, values in (
+        (LETTER, ASCII_CODES["letter"]),
+        (DIGIT, ASCII_CODES["number"]),
+        (SIGIL, ASCII_CODES["sigil"]),
+        (PUNCTUATION, ASCII_CODES["punctuation"]),
+        (WHITESPACE, [ord(" ")]),
+        (KEYWORD, range(0x80, 0x100)),
+    ):
+        for value in values:
+            table[value] |= flag
+
+    return bytes(table)
+
+
+BYTE_CLASSES = _build_byte_classes()
+
 
 ASSEMBLY_CHARS = string.digits + ", "
+
+
+# the "petscii-c64" codec, bytes are decoded into the listing text the lexer writes for string & comment literals:
+# control chars and graphics as {ctrl} codes from BYTE_TO_CTRL, letters lowercased
+PETSCII_CODEC = "petscii-c64"
+
+
+def _build_decoding_table() -> dict[int, str]:
+    """Build the text of each byte value, values without a text are left to the error handler of the codec."""
+
+    table = {value: chr(value).lower() for value in range(0x80)}
+    table.update((byte[0], text) for byte, text in BYTE_TO_CTRL.items())
+    return table
+
+
+DECODING_TABLE = _build_decoding_table()
+# text -> byte value, texts of several byte values are encoded as the lowest one
+ENCODING_TABLE = {text: value for value, text in sorted(DECODING_TABLE.items(), reverse=True)}
+# the {ctrl} codes are matched as a whole, longest first, every other char on its own
+ENCODING_PATTERN = re.compile(
+    "|".join(re.escape(text) for text in sorted(ENCODING_TABLE, key=len, reverse=True) if len(text) > 1) + "|.",
+    re.DOTALL,
+)
+
+
+def petscii_decode(data: bytes | memoryview, errors: str = "strict") -> tuple[str, int]:
+    """Decode PETSCII bytes in one call with the 256-entry decoding table.
+
+    Args:
+        data (bytes | memoryview): The PETSCII bytes, e.g. a string literal of a BASIC line.
+        errors (str): The error handler for byte values without a text, like for `bytes.decode`.
+
+    Returns:
+        tuple[str, int]: The decoded text and the number of consumed bytes.
+    """
+    return codecs.charmap_decode(data, errors, DECODING_TABLE)
+
+
+def petscii_encode(text: str, errors: str = "strict") -> tuple[bytes, int]:
+    """Encode a listing text into PETSCII bytes, the reverse of `petscii_decode`.
+
+    Args:
+        text (str): The text, control chars and graphics written as {ctrl} codes.
+        errors (str): The error handler for chars without a byte value, like for `str.encode`.
+
+    Returns:
+        tuple[bytes, int]: The encoded bytes and the number of consumed chars.
+    """
+
+    output = bytearray()
+    for match in ENCODING_PATTERN.finditer(text):
+        value = ENCODING_TABLE.get(match.group())
+        if value is not None:
+            output.append(value)
+            continue
+
+        error = UnicodeEncodeError(PETSCII_CODEC, text, match.start(), match.end(), "character maps to <undefined>")
+        replacement, _ = codecs.lookup_error(errors)(error)
+        output += replacement if isinstance(replacement, bytes) else replacement.encode("ascii")
+
+    return bytes(output), len(text)
+
+
+def _search_codec(name: str) -> codecs.CodecInfo | None:
+    """Find the PETSCII codec, the codec registry passes the name lowercased and with spaces as underscores."""
+
+    if name.replace("_", "-") != PETSCII_CODEC:
+        return None
+    return codecs.CodecInfo(name=PETSCII_CODEC, encode=petscii_encode, decode=petscii_decode)
+
+
+codecs.register(_search_codec)
@@ -0,0 +1,188 @@
+"""The script provides functions to read tokenized Commodore BASIC program (PRG) files."""
+
+import mmap
+import os
+import warnings
+from collections.abc import Generator
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from typing import Self
+
+import numpy as np
+
+
+HEADER_SIZE = 2  # little-endian load address
+LINE_HEADER_SIZE = 4  # pointer to the next line & line number
+
+
+def split_lines(data: bytes | memoryview) -> tuple[np.ndarray, np.ndarray]:
+    """Split a tokenized BASIC program into its lines in a single pass over the buffer.
+
+    Each line consists of a 2-byte pointer to the next line, a 2-byte line number and the tokenized text ending in
+    0x00. The line end is taken from the next-line pointer chain. If a pointer does not point at the first terminator
+    after the line header (e.g. a file saved with stale line links) the terminator is searched in the precomputed zero
+    offsets instead. The program ends at a line number 0 followed by zero bytes only. A truncated file ends at its
+    last complete line, a warning is issued for the rest.
+
+    Args:
+        data (bytes | memoryview): The content of the PRG file including the 2-byte load address header.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The line numbers with shape (n,) and the (start, end) byte offsets of the
+            line texts with shape (n, 2).
+    """
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    end = len(buffer)
+    if end < HEADER_SIZE:
+        return np.empty(0, dtype=np.uint16), np.empty((0, 2), dtype=np.int64)
+
+    is_zero = buffer == 0
+    zeros = np.flatnonzero(is_zero)
+    zero_count = np.concatenate(([0], np.cumsum(is_zero)))  # zero_count[i] = number of zeros in data[:i]
+    nonzero = np.flatnonzero(~is_zero)
+    data_end = int(nonzero[-1]) + 1 if len(nonzero) else 0  # everything from here on is zero padding
+
+    words = buffer[:-1].astype(np.uint16) | (buffer[1:].astype(np.uint16) << 8)  # words[i] = uint16 at offset i
+    load_address = int(words[0])
+
+    linenos: list[int] = []
+    offsets: list[tuple[int, int]] = []
+
+    pos = HEADER_SIZE
+    while pos < end - LINE_HEADER_SIZE:
+        ptr = int(words[pos])
+        lineno = int(words[pos + 2])
+        pos += LINE_HEADER_SIZE
+
+        if lineno == 0 and pos >= data_end:  # rest of file contains only zero bytes
+            break
+
+        eol = ptr - load_address + HEADER_SIZE - 1
+        if not (pos <= eol < end and is_zero[eol] and zero_count[eol] == zero_count[pos]):
+            # broken pointer chain, fall back to the 0x00 terminator
+            idx = np.searchsorted(zeros, pos)
+            if idx == len(zeros):
+                warnings.warn(f"no EOL 0x00 found after byte {pos}, assuming EOF", stacklevel=2)
+                break
+            eol = int(zeros[idx])
+
+        linenos.append(lineno)
+        offsets.append((pos, eol))
+        pos = eol + 1  # skip the 0x00
+
+    return np.array(linenos, dtype=np.uint16), np.array(offsets, dtype=np.int64).reshape(-1, 2)
+
+
+class LineIndex:
+    """A class that maps the BASIC line numbers of a PRG file to the byte offsets of the line texts.
+
+    The index is built once from the next-line pointer chain and can be saved next to the PRG file. Looking up a
+    line range is a binary search over the sorted line numbers.
+    """
+
+    def __init__(self, linenos: np.ndarray, offsets: np.ndarray, source_stat: tuple[int, int] = (-1, -1)) -> None:
+        order = np.argsort(linenos, kind="stable")
+        self.linenos = np.asarray(linenos, dtype=np.uint16)[order]
+        self.offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)[order]
+        self.source_stat = source_stat  # (size, mtime_ns) of the indexed file
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__qualname__}(lines={len(self)})"
+
+    def __len__(self) -> int:
+        return len(self.linenos)
+
+    def __contains__(self, lineno: int) -> bool:
+        idx = np.searchsorted(self.linenos, lineno)
+        return idx < len(self) and self.linenos[idx] == lineno
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> Self:
+        """Build the index of a PRG file."""
+
+        path = Path(path)
+        stat = path.stat()
+        linenos, offsets = split_lines(path.read_bytes())
+        return cls(linenos, offsets, (stat.st_size, stat.st_mtime_ns))
+
+    @classmethod
+    def load(cls, path: str | Path) -> Self:
+        """Load an index saved with `save`."""
+
+        with np.load(path) as data:
+            return cls(data["linenos"], data["offsets"], tuple(data["source_stat"].tolist()))
+
+    def save(self, path: str | Path) -> None:
+        with Path(path).open("wb") as file:
+            np.savez(file, linenos=self.linenos, offsets=self.offsets, source_stat=np.array(self.source_stat))
+        return None
+
+    def is_current(self, path: str | Path) -> bool:
+        """Check if the indexed file was not modified since the index was built."""
+
+        stat = Path(path).stat()
+        return self.source_stat == (stat.st_size, stat.st_mtime_ns)
+
+    def find(self, first: int, last: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return the line numbers and (start, end) offsets of all lines from `first` to `last` (inclusive)."""
+
+        last = first if last is None else last
+        start = np.searchsorted(self.linenos, first, side="left")
+        end = np.searchsorted(self.linenos, last, side="right")
+        return self.linenos[start:end], self.offsets[start:end]
+
+
+def read_lines(
+    path: str | Path, index: LineIndex, first: int, last: int | None = None
+) -> Generator[tuple[int, bytes], None, None]:
+    """Read the texts of the lines from `first` to `last` (inclusive) without decoding the rest of the file.
+
+    Args:
+        path (str | Path): The PRG file.
+        index (LineIndex): The line index of the file.
+        first (int): The first line number.
+        last (int | None): The last line number, if None only the line `first` is read.
+
+    Yields:
+        tuple[int, bytes]: The line number and the tokenized text of each line.
+    """
+
+    linenos, offsets = index.find(first, last)
+    with Path(path).open("rb") as file:
+        for lineno, (start, end) in zip(linenos.tolist(), offsets.tolist(), strict=True):
+            file.seek(start)
+            yield (lineno, file.read(end - start))
+
+    return None
+
+
+@contextmanager
+def open_prg(path: str | Path) -> Generator[memoryview, None, None]:
+    """Memory-map a file and provide a read-only, zero-copy view on its content.
+
+    Slices of the view must not be kept after the context is left, the mapping can not be closed otherwise.
+    """
+
+    with Path(path).open("rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # an empty file can not be memory-mapped
+            yield memoryview(b"")
+            return None
+
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        except BaseException:
+            # the frames of the traceback may still reference slices of the view, closing it would raise a
+            # BufferError instead of the error of the caller. The mapping is closed once the slices are freed.
+            with suppress(BufferError):
+                view.release()
+                mapped.close()
+            raise
+
+        view.release()
+        mapped.close()
+
+    return None
@@ -1,28 +1,80 @@
-import string
-
 from preprocessing.basics import BASICToken
+from preprocessing.petscii import BYTE_CLASSES, BYTE_TO_CMD, DIGIT, LETTER, PUNCTUATION, SIGIL
 
 
-sigils = "$%!"
-punctuations = [p for p in string.punctuation if p not in sigils]
-
-ASCII_CODES = {
-    "letter": [ord(char) for char in string.ascii_letters],
-    "number": [ord(char) for char in string.digits],
-    "sigil": [ord(char) for char in sigils],
-    "punctuation": [ord(char) for char in punctuations],
+OPERATOR_BYTES = {
+    "arithmetic": (0xAA, 0xAB, 0xAC, 0xAD, 0xAE),
+    "relational": (0xB1, 0xB2, 0xB3),
+    "logical": (0xA8, 0xAF, 0xB0),
 }
 
-ASSEMBLY_CHARS = string.digits + ", "
-
 
 class Tagger:
     def __init__(self, tagset: dict) -> None:
         self.tagset = tagset
-        self.asciiCodes = {char: key for key, value in ASCII_CODES.items() for char in value}
+        self.tags: list[str | None] = [None, "unknown", "?_unknown", *self._collect_tags(tagset)]
+        self.tag_ids = {tag: idx for idx, tag in enumerate(self.tags)}
+
+        # the tagset compiled into flat lookup tables
+        self.token_tags = self._compile_token_tags(tagset)
+        self.command_tags = self._compile_command_tags(tagset)
+        self.ascii_tags = self._compile_ascii_tags(tagset)
 
         return None
 
+    def _collect_tags(self, tagging: dict) -> list[str]:
+        """Collect all tags of the tagset in their order of appearance."""
+
+        if "tag" in tagging:
+            return [tagging["tag"]]
+
+        tags = []
+        for value in tagging.values():
+            tags.extend(tag for tag in self._collect_tags(value) if tag not in tags)
+        return tags
+
+    def _compile_token_tags(self, tagset: dict) -> dict[str, str]:
+        """Map each command and constant token to its tag, the first tagging of a token wins."""
+
+        token_tags: dict[str, str] = {}
+        for category in ("commands", "constants"):
+            for tagging in tagset[category].values():
+                for token in tagging["values"]:
+                    token_tags.setdefault(token, tagging["tag"])
+        return token_tags
+
+    def _compile_command_tags(self, tagset: dict) -> list[str | None]:
+        """Map each command byte value to its tag, operators are tagged by their byte value."""
+
+        command_tags: list[str | None] = [None] * 256
+        for byte, token in BYTE_TO_CMD.items():
+            command_tags[byte[0]] = self.token_tags.get(token)
+
+        for operator, values in OPERATOR_BYTES.items():
+            for value in values:
+                command_tags[value] = tagset["operators"][operator]["tag"]
+        return command_tags
+
+    def _compile_ascii_tags(self, tagset: dict) -> list[str]:
+        """Map each ASCII byte value to its default tag."""
+
+        punctuation_tags: dict[str, str] = {}
+        for tagging in tagset["punctuations"].values():
+            for token in tagging["values"]:
+                punctuation_tags.setdefault(token, tagging["tag"])
+
+        ascii_tags = ["unknown"] * 256
+        for value, byte_class in enumerate(BYTE_CLASSES):
+            if byte_class & LETTER:
+                ascii_tags[value] = tagset["variables"]["real"]["tag"]
+            elif byte_class & DIGIT:
+                ascii_tags[value] = tagset["numbers"]["integer"]["tag"]
+            elif byte_class & SIGIL:
+                ascii_tags[value] = tagset["punctuations"]["type"]["tag"]
+            elif byte_class & PUNCTUATION:
+                ascii_tags[value] = punctuation_tags.get(chr(value), tagset["punctuations"]["other"]["tag"])
+        return ascii_tags
+
     def parse_print(self, btoken: BASICToken, decoded_tokens: list[BASICToken] = None) -> str:
         return self.tagset["strings"]["print"]["tag"]
 
@@ -33,55 +85,16 @@ class Tagger:
         return self.tagset["strings"]["string"]["tag"]
 
     def parse_ascii(self, btoken: BASICToken, decoded_tokens: list[BASICToken] = None) -> str:
-        ascii_type = self.asciiCodes.get(btoken.value, "unknown")
-
-        match ascii_type:
-            case "letter":
-                return self.tagset["variables"]["real"]["tag"]
-
-            case "number":
-                if decoded_tokens and decoded_tokens[-1].token == ".":
-                    return self.tagset["numbers"]["real"]["tag"]
-                return self.tagset["numbers"]["integer"]["tag"]
-
-            case "sigil":
-                return self.tagset["punctuations"]["type"]["tag"]
+        tag = self.ascii_tags[btoken.value]
 
-            case "punctuation":
-                for tagging in self.tagset["punctuations"].values():
-                    if btoken.token in tagging["values"]:
-                        return tagging["tag"]
-                return self.tagset["punctuations"]["other"]["tag"]
-
-            case _:
-                # msg = f"can not parse ascii btoken of value {btoken.value}"
-                # raise ValueError(msg)
-                return "unknown"
+        if BYTE_CLASSES[btoken.value] & DIGIT and decoded_tokens and decoded_tokens[-1].token == ".":
+            return self.tagset["numbers"]["real"]["tag"]
+        return tag
 
     def parse_command(self, btoken: BASICToken) -> str:
-        operator = self._parse_operator(btoken)
-        if operator is not None:
-            return operator
-
-        for tagging in self.tagset["commands"].values():
-            if btoken.token in tagging["values"]:
-                return tagging["tag"]
-
-        for tagging in self.tagset["constants"].values():
-            if btoken.token in tagging["values"]:
-                return tagging["tag"]
+        tag = self.command_tags[btoken.value]
+        if tag is not None:
+            return tag
 
         msg = f"can not parse command btoken of token {btoken.token}"
         raise ValueError(msg)
-
-    def _parse_operator(self, btoken: BASICToken) -> str | None:
-        if btoken.value in (0xAA, 0xAB, 0xAC, 0xAD, 0xAE):
-            return self.tagset["operators"]["arithmetic"]["tag"]
-
-        elif btoken.value in (0xB1, 0xB2, 0xB3):
-            return self.tagset["operators"]["relational"]["tag"]
-
-        elif btoken.value in (0xA8, 0xAF, 0xB0):
-            return self.tagset["operators"]["logical"]["tag"]
-
-        return None
@@ -0,0 +1,227 @@
+"""The script provides a compact form of the tokenized dataset as flat id arrays with the offsets of its parts."""
+
+import json
+from pathlib import Path
+from typing import NamedTuple, Self
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.vocabulary import Vocabulary
+
+
+ARRAYS = ("vocab_ids", "tag_ids", "lines", "file_offsets", "line_offsets", "statement_offsets", "file_ids", "game_ids")
+NO_GAME = -1  # game_id of the files without metadata
+STATEMENT_SEPARATOR = ":"
+
+
+class TokenSpan(NamedTuple):
+    vocab_ids: np.ndarray
+    tag_ids: np.ndarray
+    lines: np.ndarray
+
+
+class TokenizedCorpus:
+    """A class that stores the tokens of the corpus in contiguous arrays, with the boundaries of its parts as offsets.
+
+    The layout is the one of a CSR matrix: file, line and statement i are the tokens between offsets[i] and
+    offsets[i + 1] of their offset array. Every slice is a view on the arrays, also when they are memory-mapped.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Vocabulary,
+        vocab_ids: np.ndarray,
+        tag_ids: np.ndarray,
+        lines: np.ndarray,
+        file_offsets: np.ndarray,
+        line_offsets: np.ndarray,
+        statement_offsets: np.ndarray,
+        file_ids: np.ndarray,
+        game_ids: np.ndarray,
+        names: list[str],
+    ) -> None:
+        """Create the corpus from its arrays, use `from_dataframe`, `from_dataset` or `load` instead.
+
+        Args:
+            vocabulary (Vocabulary): The vocabulary of the token & tag ids.
+            vocab_ids (np.ndarray): The uint32 token id of each token.
+            tag_ids (np.ndarray): The uint8 tag id of each token.
+            lines (np.ndarray): The BASIC line number of each token.
+            file_offsets (np.ndarray): The index of the first token of each file and the number of tokens.
+            line_offsets (np.ndarray): The index of the first token of each line and the number of tokens.
+            statement_offsets (np.ndarray): The index of the first token of each statement and the number of tokens.
+            file_ids (np.ndarray): The file_id of each file.
+            game_ids (np.ndarray): The game_id of each file, NO_GAME if it is unknown.
+            names (list[str]): The program name of each file.
+        """
+
+        self.vocabulary = vocabulary
+        self.vocab_ids = vocab_ids
+        self.tag_ids = tag_ids
+        self.lines = lines
+        self.file_offsets = file_offsets
+        self.line_offsets = line_offsets
+        self.statement_offsets = statement_offsets
+        self.file_ids = file_ids
+        self.game_ids = game_ids
+        self.names = names
+
+        self._file_index = {int(file_id): index for index, file_id in enumerate(file_ids)}
+
+    def __str__(self) -> str:
+        return (
+            f"{self.__class__.__qualname__}(tokens={len(self)}, files={self.n_files}, lines={self.n_lines}, "
+            f"statements={self.n_statements})"
+        )
+
+    def __len__(self) -> int:
+        return len(self.vocab_ids)
+
+    @property
+    def n_files(self) -> int:
+        return len(self.file_offsets) - 1
+
+    @property
+    def n_lines(self) -> int:
+        return len(self.line_offsets) - 1
+
+    @property
+    def n_statements(self) -> int:
+        return len(self.statement_offsets) - 1
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, vocabulary: Vocabulary | None = None) -> Self:
+        """Build the corpus from a token table with the columns of the tokenized dataset.
+
+        The rows of a file must be in the order of its lines, the files are kept in the order of their first row.
+        A statement ends after a ":" token or at the end of its line. Programs without metadata have no file_id,
+        their rows are left out.
+
+        Args:
+            df (pd.DataFrame): The token table.
+            vocabulary (Vocabulary | None): The vocabulary of the vocab_id & tag_id columns of the table. If None,
+                the token & syntax columns are encoded with a new vocabulary.
+
+        Returns:
+            TokenizedCorpus: The corpus.
+        """
+
+        df = df[df["file_id"].notna()]
+        file_codes, file_ids = pd.factorize(df["file_id"])
+        order = np.argsort(file_codes, kind="stable")
+        file_codes = file_codes[order]
+
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+            vocab_ids = vocabulary.encode_tokens(df["token"])[order]
+            tag_ids = vocabulary.encode_tags(df["syntax"])[order]
+        else:
+            vocab_ids = df["vocab_id"].to_numpy(np.uint32)[order]
+            tag_ids = df["tag_id"].to_numpy(np.uint8)[order]
+        lines = df["line"].to_numpy(np.uint16)[order]
+
+        new_file = np.diff(file_codes, prepend=-1) != 0
+        new_line = new_file | (np.diff(lines.astype(np.int64), prepend=-1) != 0)
+        is_separator = vocab_ids == vocabulary.token_ids.get(STATEMENT_SEPARATOR, -1)
+
+        file_starts = np.flatnonzero(new_file)
+        line_starts = np.flatnonzero(new_line)
+        statement_starts = np.union1d(line_starts, np.flatnonzero(is_separator[:-1]) + 1)
+
+        def offsets(starts: np.ndarray) -> np.ndarray:
+            return np.append(starts, len(vocab_ids)).astype(np.int64)
+
+        first_rows = order[file_starts]
+        return cls(
+            vocabulary,
+            vocab_ids,
+            tag_ids,
+            lines,
+            offsets(file_starts),
+            offsets(line_starts),
+            offsets(statement_starts),
+            np.asarray(file_ids, dtype=np.int64),
+            df["game_id"].iloc[first_rows].fillna(NO_GAME).to_numpy(np.int64),
+            df["name"].iloc[first_rows].astype(str).tolist(),
+        )
+
+    @classmethod
+    def from_dataset(cls, path: str | Path) -> Self:
+        """Build the corpus from the tokenized dataset, its id columns are used if the vocabulary is next to it."""
+
+        path = Path(path)
+        vocabulary_file = path.parent / "vocabulary.json"
+        vocabulary = Vocabulary.load(vocabulary_file) if vocabulary_file.is_file() else None
+
+        columns = ["file_id", "game_id", "name", "line", "token", "syntax"]
+        if vocabulary is not None:
+            columns = ["file_id", "game_id", "name", "line", "vocab_id", "tag_id"]
+        return cls.from_dataframe(pd.read_parquet(path, columns=columns), vocabulary)
+
+    def save(self, path: str | Path) -> None:
+        """Save the corpus as a directory of .npy arrays, the vocabulary and the file names."""
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        for name in ARRAYS:
+            np.save(path / f"{name}.npy", getattr(self, name))
+        self.vocabulary.save(path / "vocabulary.json")
+        (path / "names.json").write_text(json.dumps(self.names, ensure_ascii=False), "utf-8")
+        return None
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> Self:
+        """Load a corpus saved with `save`, by default the arrays are memory-mapped read-only instead of read."""
+
+        path = Path(path)
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None) for name in ARRAYS}
+        vocabulary = Vocabulary.load(path / "vocabulary.json")
+        names = json.loads((path / "names.json").read_text("utf-8"))
+        return cls(vocabulary, **arrays, names=names)
+
+    def tokens(self, start: int, end: int) -> TokenSpan:
+        """Return the views of the tokens from index `start` to `end`."""
+        return TokenSpan(self.vocab_ids[start:end], self.tag_ids[start:end], self.lines[start:end])
+
+    def file(self, index: int) -> TokenSpan:
+        return self.tokens(self.file_offsets[index], self.file_offsets[index + 1])
+
+    def line(self, index: int) -> TokenSpan:
+        return self.tokens(self.line_offsets[index], self.line_offsets[index + 1])
+
+    def statement(self, index: int) -> TokenSpan:
+        return self.tokens(self.statement_offsets[index], self.statement_offsets[index + 1])
+
+    def file_index(self, file_id: int) -> int:
+        """Return the index of a file by its file_id."""
+        return self._file_index[int(file_id)]
+
+    def file_lines(self, index: int) -> range:
+        """Return the indices of the lines of a file."""
+
+        start, end = np.searchsorted(self.line_offsets, self.file_offsets[index : index + 2])
+        return range(int(start), int(end))
+
+    def game(self, game_id: int) -> TokenSpan:
+        """Return the views of the tokens of all files of a game, the files have to be stored one after another."""
+
+        files = np.flatnonzero(self.game_ids == game_id)
+        if not len(files):
+            msg = f"no files of game {game_id} in the corpus"
+            raise KeyError(msg)
+        elif files[-1] - files[0] + 1 != len(files):
+            msg = f"the files of game {game_id} are not stored one after another, sort the dataset by game_id"
+            raise ValueError(msg)
+
+        return self.tokens(self.file_offsets[files[0]], self.file_offsets[files[-1] + 1])
+
+    def statement_tokens(self) -> list[list[str]]:
+        """Return the tokens of each statement as strings, e.g. as the sentences of an n-gram model."""
+
+        if not self.n_statements:
+            return []
+
+        tokens = self.vocabulary.decode_tokens(self.vocab_ids)
+        return [statement.tolist() for statement in np.split(tokens, self.statement_offsets[1:-1])]
@@ -0,0 +1,140 @@
+"""The script validates the lexer by diffing every lexed program of the corpus against its petcat listing."""
+
+import argparse
+import difflib
+import json
+import os
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+from rich import print, traceback
+
+from preprocessing.corpus import CORPUS_PATH, find_source_files
+from preprocessing.lexer import Lexer
+from preprocessing.tagset import TAGSET
+
+
+traceback.install()
+
+# spaces are not significant, the lexer drops them outside of strings
+NORMALIZATION_TABLE = str.maketrans("", "", " \r\n")
+
+_lexer: Lexer | None = None  # one lexer per worker process
+
+
+def normalize_line(line: str) -> str:
+    """Normalize a listing line for the comparison, the line is lowercased and all spaces are removed."""
+    return line.lower().translate(NORMALIZATION_TABLE)
+
+
+def show_file_diffs(file1: str, file2: str) -> None:
+    with open(file1, "r") as file:
+        tokenized = [normalize_line(line) for line in file.readlines()]
+
+    with open(file2, "r") as file:
+        ground_truth = [normalize_line(line) for line in file.readlines()]
+
+    diff = difflib.unified_diff(ground_truth, tokenized, lineterm="")
+    for line in diff:
+        print(line)
+
+    return None
+
+
+def lexed_lines(source_file: Path) -> list[str]:
+    """Lex a file and return its normalized lines as they would be listed."""
+
+    global _lexer
+    if _lexer is None:
+        _lexer = Lexer(TAGSET)
+
+    bfile = _lexer.detokenize_basic_file(source_file)
+    tokens = bfile.buffer.tokens
+    return [normalize_line(f"{lineno}{''.join(map(str, tokens[start:end]))}") for lineno, start, end in bfile.lines]
+
+
+def validate_file(source_file: Path, listing_file: Path) -> dict:
+    """Diff the lexer output of one file against its petcat listing.
+
+    This is the worker function of the process pool.
+
+    Args:
+        source_file (Path): The encoded BASIC file.
+        listing_file (Path): The petcat listing of the file.
+
+    Returns:
+        dict: The summary of the file, with the status 'ok', 'mismatch', 'missing' (no listing) or 'error' and the
+            mismatching lines of the lexer output and the listing.
+    """
+
+    summary = {"disk": source_file.parent.name, "name": source_file.name, "listing": str(listing_file)}
+    if not listing_file.is_file():
+        return summary | {"status": "missing"}
+
+    try:
+        lexed = lexed_lines(source_file)
+    except Exception as error:  # a lexer crash is a validation result as well
+        return summary | {"status": "error", "error": repr(error)}
+
+    with listing_file.open(encoding="utf-8", errors="replace") as file:
+        listing = [line for line in map(normalize_line, file) if line]
+
+    mismatches = []
+    matcher = difflib.SequenceMatcher(None, lexed, listing, autojunk=False)
+    for opcode, i1, i2, j1, j2 in matcher.get_opcodes():
+        if opcode != "equal":
+            mismatches.append({"lexed": lexed[i1:i2], "listing": listing[j1:j2]})
+
+    return summary | {
+        "status": "mismatch" if mismatches else "ok",
+        "lines": len(lexed),
+        "mismatched_lines": sum(max(len(m["lexed"]), len(m["listing"])) for m in mismatches),
+        "mismatches": mismatches,
+    }
+
+
+def validate_corpus(source_files: list[Path], listing_path: Path, jobs: int = 1) -> Iterable[dict]:
+    """Validate the files in a process pool and yield their summaries in the order of `source_files`.
+
+    The listing of a file is expected at <listing_path>/<disk>/<name>.bas, e.g. <corpus>/decoded/petcat/<disk>.
+    """
+
+    listing_files = [listing_path / file.parent.name / f"{file.name}.bas" for file in source_files]
+
+    with ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext() as executor:
+        map_func = executor.map if executor else map
+        yield from map_func(validate_file, source_files, listing_files)
+
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diff the lexer output of all corpus files against petcat.")
+    parser.add_argument("--corpus", type=Path, default=CORPUS_PATH, help="the corpus directory")
+    parser.add_argument(
+        "--listings", type=Path, help="the directory of the petcat listings, defaults to <corpus>/decoded/petcat"
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-o", "--output", type=Path, help="the summary file, defaults to <corpus>/validation.jsonl")
+    args = parser.parse_args()
+
+    source_files = find_source_files(args.corpus / "encoded")
+    listing_path = args.listings or args.corpus / "decoded" / "petcat"
+    output_file = args.output or args.corpus / "validation.jsonl"
+
+    # a wrong listing directory would report every file as missing
+    disks = sorted({file.parent.name for file in source_files})
+    if not any((listing_path / disk).is_dir() for disk in disks):
+        parser.error(f"no listings of the disks {', '.join(disks)} in {listing_path}, pass the directory with --listings")
+
+    counts = {"ok": 0, "mismatch": 0, "missing": 0, "error": 0}
+    with output_file.open("w", encoding="utf-8") as file:
+        for summary in validate_corpus(source_files, listing_path, args.jobs):
+            file.write(json.dumps(summary) + "\n")
+            counts[summary["status"]] += 1
+            if summary["status"] != "ok":
+                print(f"{summary['status']:>8} {summary['disk']}/{summary['name']}", summary.get("mismatched_lines", ""))
+
+    print(f"{len(source_files)} files validated: {counts}, summary written to {output_file}")
@@ -0,0 +1,129 @@
+"""The script provides the persisted vocabulary of the token and tag ids of the tokenized dataset."""
+
+import json
+import os
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Self
+
+import numpy as np
+import pandas as pd
+
+
+class Vocabulary:
+    """A class that maps the tokens and tags of the dataset to integer ids.
+
+    Ids are only ever appended, so the id columns of files written with an older state of the vocabulary stay valid.
+    Tag id 0 is the missing tag, like in the TokenBuffer.
+    """
+
+    def __init__(self, tokens: Sequence[str] = (), tags: Sequence[str | None] = ()) -> None:
+        self.tokens: list[str] = []
+        self.token_ids: dict[str, int] = {}
+        self.tags: list[str | None] = [None]
+        self.tag_ids: dict[str | None, int] = {None: 0}
+
+        for token in tokens:
+            self.token_id(token)
+        for tag in tags:
+            self.tag_id(tag)
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__qualname__}(tokens={len(self.tokens)}, tags={len(self.tags)})"
+
+    def token_id(self, token: str) -> int:
+        """Return the id of a token, unknown tokens are added."""
+
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = self.token_ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
+
+    def tag_id(self, tag: str | None) -> int:
+        """Return the id of a tag, unknown tags are added."""
+
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            if len(self.tags) > np.iinfo(np.uint8).max:
+                msg = f"can not add tag {tag!r}, the tag ids are limited to {np.iinfo(np.uint8).max + 1} tags"
+                raise ValueError(msg)
+            tag_id = self.tag_ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return tag_id
+
+    def encode_tokens(self, tokens: Iterable[str]) -> np.ndarray:
+        """Return the uint32 ids of a token column, each distinct token is looked up once."""
+
+        codes, uniques = pd.factorize(np.asarray(tokens, dtype=object))
+        ids = np.fromiter((self.token_id(token) for token in uniques), dtype=np.uint32, count=len(uniques))
+        return ids[codes]
+
+    def encode_tags(self, tags: Iterable[str | None]) -> np.ndarray:
+        """Return the uint8 ids of a tag column, a missing tag gets id 0."""
+
+        codes, uniques = pd.factorize(np.asarray(tags, dtype=object), use_na_sentinel=False)
+        ids = np.fromiter(
+            (self.tag_id(None if pd.isna(tag) else tag) for tag in uniques), dtype=np.uint8, count=len(uniques)
+        )
+        return ids[codes]
+
+    def decode_tokens(self, ids: np.ndarray) -> np.ndarray:
+        """Return the tokens of an id array as an object array."""
+        return np.asarray(self.tokens, dtype=object)[ids]
+
+    def decode_tags(self, ids: np.ndarray) -> np.ndarray:
+        """Return the tags of an id array as an object array."""
+        return np.asarray(self.tags, dtype=object)[ids]
+
+    def save(self, path: str | Path) -> None:
+        """Save the vocabulary as a JSON file."""
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file first, so an interrupted run never leaves a broken vocabulary behind
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"tokens": self.tokens, "tags": self.tags}, ensure_ascii=False), "utf-8")
+        tmp_path.replace(path)
+        return None
+
+    @classmethod
+    def load(cls, path: str | Path) -> Self:
+        """Load a vocabulary saved with `save`."""
+
+        data = json.loads(Path(path).read_text("utf-8"))
+        return cls(data["tokens"], data["tags"][1:])
+
+    @classmethod
+    def load_or_create(cls, path: str | Path) -> Self:
+        """Load a vocabulary if the file exists, otherwise return an empty one."""
+        return cls.load(path) if Path(path).is_file() else cls()
+
+
+def count_ngrams(ids: Sequence[np.ndarray], starts: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Count n-grams in id arrays with NumPy, the k-th element of an n-gram is read from the k-th array.
+
+    The arrays are aligned, so an n-gram can mix id spaces, e.g. a token id followed by two tag ids of the tokens
+    after it. The n-grams are returned in the order of their first occurrence, like a Counter would list them.
+
+    Args:
+        ids (Sequence[np.ndarray]): The n id arrays, all of the same length.
+        starts (np.ndarray | None): A boolean mask of the positions an n-gram may start at, None allows all.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The distinct n-grams as an (m, n) array and the count of each.
+    """
+
+    n = len(ids)
+    length = len(ids[0]) - n + 1
+    if length <= 0:
+        return np.empty((0, n), dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    windows = np.stack([np.asarray(column[k : k + length], dtype=np.int64) for k, column in enumerate(ids)], axis=1)
+    if starts is not None:
+        windows = windows[np.asarray(starts[:length], dtype=bool)]
+
+    ngrams, first, counts = np.unique(windows, axis=0, return_index=True, return_counts=True)
+    order = np.argsort(first, kind="stable")
+    return ngrams[order], counts[order]
@@ -0,0 +1,172 @@
+"""The script watches the encoded programs of the corpus and lexes new or changed ones into the partitioned dataset.
+
+The directories are polled, a program is lexed if its file in the partitioned dataset is missing or older than the
+program. The first poll of an empty dataset therefore builds it from scratch, later polls only add what changed.
+"""
+
+import argparse
+import shutil
+import time
+from pathlib import Path
+
+from rich import print, traceback
+
+from preprocessing.cache import LexerCache
+from preprocessing.corpus import CORPUS_PATH, SKIPPED_FILES, find_source_files, lex_file
+from preprocessing.dataset import partition_file, read_metadata, write_partition_file
+from preprocessing.tagset import TAGSET
+from preprocessing.vocabulary import Vocabulary
+
+
+traceback.install()
+
+SETTLE_TIME = 2.0  # seconds without a modification before a file is lexed, it may still be copied otherwise
+
+
+def move_queued_files(queue_path: Path, source_path: Path) -> list[Path]:
+    """Move the programs of a queue directory, laid out as <queue>/<disk>/<name>, into the encoded directory."""
+
+    moved = []
+    for disk_dir in sorted(path for path in queue_path.iterdir() if path.is_dir()):
+        for file in sorted(disk_dir.iterdir()):
+            if not file.is_file() or file.name in SKIPPED_FILES or time.time() - file.stat().st_mtime < SETTLE_TIME:
+                continue
+            (source_path / disk_dir.name).mkdir(parents=True, exist_ok=True)
+            moved.append(Path(shutil.move(file, source_path / disk_dir.name / file.name)))
+
+    return moved
+
+
+def find_changed_files(source_path: Path, dataset_dir: Path, metadata: dict[str, tuple[int, int]]) -> list[Path]:
+    """Return the programs of all disks whose file in the partitioned dataset is missing or outdated."""
+
+    disks = sorted(path.name for path in source_path.iterdir() if path.is_dir())
+
+    changed = []
+    for file in find_source_files(source_path, disks):
+        mtime = file.stat().st_mtime
+        if time.time() - mtime < SETTLE_TIME:
+            continue
+
+        # the file is looked up in the partition of the current metadata, a new game_id moves the program
+        game_id = metadata.get(file.name, (None, None))[1]
+        table_file = partition_file(dataset_dir, file.parent.name, file.name, game_id)
+        if not table_file.is_file() or table_file.stat().st_mtime < mtime:
+            changed.append(file)
+
+    return changed
+
+
+def lex_program(source_file: Path, cache: LexerCache | None = None) -> dict[str, list]:
+    """Lex one program, or read its token table from the cache, and return the table as column lists."""
+
+    if cache is None:
+        return lex_file(source_file)
+
+    key = cache.key(source_file.read_bytes())
+    columns = cache.get(key)
+    if columns is None:
+        columns = lex_file(source_file)
+        cache.put(key, {name: column for name, column in columns.items() if name != "name"})
+        return columns
+
+    return {"name": [source_file.name] * len(columns["line"])} | columns
+
+
+def watch(
+    source_path: Path,
+    dataset_dir: Path,
+    metadata_file: Path,
+    vocabulary_file: Path,
+    cache: LexerCache | None = None,
+    queue_path: Path | None = None,
+    interval: float = 10.0,
+    once: bool = False,
+) -> None:
+    """Poll the encoded programs and write the new or changed ones to the partitioned dataset.
+
+    Args:
+        source_path (Path): The directory of the encoded programs, one subdirectory per disk.
+        dataset_dir (Path): The root directory of the partitioned dataset.
+        metadata_file (Path): The metadata table, it is read again whenever it changes.
+        vocabulary_file (Path): The vocabulary of the token & tag ids, it is saved whenever a program adds ids.
+        cache (LexerCache | None): If given, programs are read from the cache and only new contents are lexed.
+        queue_path (Path | None): A directory whose programs are moved to `source_path` before each poll.
+        interval (float): The seconds between two polls.
+        once (bool): Poll a single time and return, e.g. to build the dataset from scratch.
+    """
+
+    metadata_mtime = None
+    metadata: dict[str, tuple[int, int]] = {}
+    skipped: dict[Path, float] = {}  # files the lexer failed on or without tokens, skipped until they are modified
+    vocabulary = Vocabulary.load_or_create(vocabulary_file)
+
+    while True:
+        if queue_path is not None:
+            for file in move_queued_files(queue_path, source_path):
+                print(f"queued {file.parent.name}/{file.name}")
+
+        if metadata_file.stat().st_mtime != metadata_mtime:
+            metadata_mtime = metadata_file.stat().st_mtime
+            metadata = read_metadata(metadata_file)
+
+        for file in find_changed_files(source_path, dataset_dir, metadata):
+            mtime = file.stat().st_mtime
+            if skipped.get(file) == mtime:
+                continue
+
+            try:
+                columns = lex_program(file, cache)
+            except Exception as error:  # one broken program should not stop the watcher
+                skipped[file] = mtime
+                print(f"Error: {file.parent.name}/{file.name}: {error!r}")
+                continue
+
+            skipped.pop(file, None)
+            vocabulary_size = (len(vocabulary.tokens), len(vocabulary.tags))
+            table_file = write_partition_file(dataset_dir, file.parent.name, columns, metadata, vocabulary)
+            if table_file is None:
+                # no file is written for a program without tokens, it would be found as changed on every poll
+                skipped[file] = mtime
+                print(f"no tokens in {file.parent.name}/{file.name}")
+                continue
+
+            if (len(vocabulary.tokens), len(vocabulary.tags)) != vocabulary_size:
+                vocabulary.save(vocabulary_file)
+            print(f"{len(columns['name'])} tokens of {file.parent.name}/{file.name} written to {table_file}")
+
+        if once:
+            break
+        time.sleep(interval)
+
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lex new or changed programs into the partitioned dataset.")
+    parser.add_argument("--corpus", type=Path, default=CORPUS_PATH, help="the corpus directory")
+    parser.add_argument("--dataset", type=Path, help="the dataset directory, defaults to <corpus>/dataset/tokens")
+    parser.add_argument("--queue", type=Path, help="a directory of new programs, laid out as <queue>/<disk>/<name>")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between two polls")
+    parser.add_argument("--once", action="store_true", help="poll a single time and exit")
+    parser.add_argument("--cache", type=Path, help="the lexer cache directory, defaults to <corpus>/cache")
+    parser.add_argument("--no-cache", action="store_true", help="lex all files without reading or writing the cache")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else LexerCache(args.cache or args.corpus / "cache", TAGSET)
+    dataset_dir = args.dataset or args.corpus / "dataset" / "tokens"
+    print(f"watching {args.corpus / 'encoded'}, writing to {dataset_dir}")
+
+    try:
+        watch(
+            args.corpus / "encoded",
+            dataset_dir,
+            args.corpus / "metadata.xlsx",
+            args.corpus / "dataset" / "vocabulary.json",
+            cache,
+            args.queue,
+            args.interval,
+            args.once,
+        )
+    except KeyboardInterrupt:
+        print("stopped watching")
@@ -0,0 +1,5 @@
+10 rem golden listing
+20 print"{clr}{rvs_on}hello{rvs_off} World"
+30 if a=1 then goto 10
+40 a$="{red}{white}{ensh}{$0a}"+chr$(34):print a$;
+50 for i=1 to 10:next:end
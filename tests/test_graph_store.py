@@ -0,0 +1,53 @@
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from analysis.meso.control_flow.flowchart.graph_store import GraphStore
+
+
+def make_graph() -> nx.DiGraph:
+    """Build a small control flow graph with the node attributes of the ControlFlowGraph."""
+
+    graph = nx.DiGraph()
+    graph.add_node("E_10", prefix="E", line=10, line_jumps=[30], token=None, conditional=False, subroutine=False,
+                   terminal=False)
+    graph.add_node("D_30", prefix="D", line=30, line_jumps=[10, 40], token="THEN", conditional=True, subroutine=False,
+                   terminal=False)
+    graph.add_node("T_40", prefix="T", line=40, line_jumps=[], token="END", conditional=False, subroutine=False,
+                   terminal=True)
+    graph.add_edges_from([("E_10", "D_30"), ("D_30", "E_10"), ("D_30", "T_40")])
+    return graph
+
+
+def test_write_read_round_trip(tmp_path: Path) -> None:
+    graph = make_graph()
+    store = GraphStore()
+    store.add(graph, 3, 1, "intro")
+    store.add(nx.DiGraph(), 4, None, "empty")
+    store.add(graph.reverse(), 5, 1, "main")
+    assert len(store) == 3
+
+    store.write(tmp_path)
+    loaded = GraphStore.read(tmp_path)
+
+    assert len(loaded) == 3
+    assert loaded.file_ids() == [3, 4, 5]
+    for file_id, expected in ((3, graph), (4, nx.DiGraph()), (5, graph.reverse())):
+        rebuilt = loaded.to_networkx(file_id)
+        assert list(rebuilt.nodes(data=True)) == list(expected.nodes(data=True))
+        assert list(rebuilt.edges) == list(expected.edges)
+        assert np.array_equal(loaded.to_numpy(file_id), nx.to_numpy_array(expected, dtype=np.int8))
+    assert loaded.graphs_table["name"].tolist() == ["intro", "empty", "main"]
+
+
+def test_add_rejects_missing_and_duplicate_file_ids() -> None:
+    store = GraphStore()
+    store.add(make_graph(), 3, 1, "intro")
+
+    with pytest.raises(ValueError, match="no file_id"):
+        store.add(make_graph(), None, None, "nometa")
+    with pytest.raises(ValueError, match="already contains"):
+        store.add(make_graph(), 3, 1, "intro")
+    assert len(store) == 1
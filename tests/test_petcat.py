@@ -0,0 +1,86 @@
+from pathlib import Path
+
+import pytest
+
+from preprocessing import petcat
+from preprocessing.d64 import BAM_TRACK, FILENAME_PADDING, TRACK_OFFSETS
+
+
+DATA_PATH = Path(__file__).parent / "data"
+SECTOR_SIZE = 256
+IMAGE_SIZE = 174_848  # 35 tracks
+
+
+def make_d64(name: bytes, data: bytes, loop: bool = False) -> bytes:
+    """Build a D64 image with one PRG file in sector 17/0, its chain links to itself if loop is set."""
+
+    image = bytearray(IMAGE_SIZE)
+
+    def sector(track: int, sector: int) -> int:
+        return (TRACK_OFFSETS[track] + sector) * SECTOR_SIZE
+
+    bam = sector(BAM_TRACK, 0)
+    image[bam : bam + 2] = bytes([BAM_TRACK, 1])
+
+    directory = sector(BAM_TRACK, 1)
+    image[directory : directory + 2] = b"\x00\xff"
+    image[directory + 2 : directory + 5] = bytes([0x82, 17, 0])  # a closed PRG starting at 17/0
+    image[directory + 5 : directory + 21] = name.ljust(16, bytes([FILENAME_PADDING]))
+
+    file = sector(17, 0)
+    image[file : file + 2] = bytes([17, 0]) if loop else bytes([0, len(data) + 1])
+    image[file + 2 : file + 2 + len(data)] = data
+    return bytes(image)
+
+
+def test_extract_skips_a_corrupt_image(tmp_path: Path) -> None:
+    d64_path = tmp_path / "d64"
+    d64_path.mkdir()
+    (d64_path / "a_broken.d64").write_bytes(make_d64(b"LOOP", b"\x01\x08", loop=True))
+    (d64_path / "b_good.d64").write_bytes(make_d64(b"GOOD", b"\x01\x08\x00\x00"))
+
+    extraction_dir = tmp_path / "corpus"
+    extraction_dir.mkdir()
+    petcat.extractD64Files(d64_path, extraction_dir)
+
+    assert not any((extraction_dir / "a_broken").iterdir())
+    assert [file.read_bytes() for file in (extraction_dir / "b_good").iterdir()] == [b"\x01\x08\x00\x00"]
+
+
+def test_extract_ignores_the_vice_bin_path(tmp_path: Path) -> None:
+    d64_path = tmp_path / "d64"
+    d64_path.mkdir()
+    (d64_path / "game.d64").write_bytes(make_d64(b"GOOD", b"\x01\x08\x00\x00"))
+
+    with pytest.warns(DeprecationWarning):
+        petcat.extractD64Files(d64_path, tmp_path, vice_bin_path=tmp_path / "vice" / "bin")
+
+    assert [file.name for file in (tmp_path / "game").iterdir()] == ["good"]
+
+
+def test_convert_reports_a_bad_prg(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def detokenize_program(data: memoryview) -> str:
+        header = data[:2]  # a slice of the mapped file that is still referenced when the error is raised
+        if bytes(header) != b"\x01\x08":
+            msg = "not a BASIC program"
+            raise ValueError(msg)
+        return original(data)
+
+    original = petcat.detokenize_program
+    monkeypatch.setattr(petcat, "detokenize_program", detokenize_program)
+
+    bad_file, good_file = tmp_path / "bad", tmp_path / "good"
+    bad_file.write_bytes(b"\x00\xc0\x00\x00")
+    good_file.write_bytes(b"\x01\x08\x00\x00")
+
+    assert petcat.convert_prg_file(bad_file) == f"{bad_file}: not a BASIC program"
+    assert bad_file.is_file()
+    assert petcat.convert_prg_file(good_file) is None
+    assert good_file.with_suffix(".bas").is_file()
+
+
+def test_detokenize_matches_the_petcat_listing() -> None:
+    # keywords, quoted control codes, a shifted letter and a byte without a name in petcat notation, written by
+    # hand since VICE is not a test dependency, compare with `petcat -2 -o golden.bas -- golden.prg` when updating it
+    listing = (DATA_PATH / "golden.bas").read_text(encoding="utf-8")
+    assert petcat.detokenize_program((DATA_PATH / "golden.prg").read_bytes()) == listing
@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import pytest
+
+from preprocessing.lexer import Lexer
+from preprocessing.prg import open_prg, split_lines
+from preprocessing.tagset import TAGSET
+
+
+def make_prg(*lines: tuple[int, bytes]) -> bytes:
+    """Build a PRG file loaded at $0801 from line numbers and tokenized line texts."""
+
+    data = bytearray(b"\x01\x08")
+    address = 0x0801
+    for lineno, text in lines:
+        address += 4 + len(text) + 1
+        data += address.to_bytes(2, "little") + lineno.to_bytes(2, "little") + text + b"\x00"
+    return bytes(data + b"\x00\x00")
+
+
+def test_open_prg_keeps_the_error_of_the_caller(tmp_path: Path) -> None:
+    path = tmp_path / "program"
+    path.write_bytes(make_prg((10, b"\x99 1")))
+
+    with pytest.raises(KeyError), open_prg(path) as view:
+        header = view[:2]  # a slice that is still referenced by the frame of the traceback
+        raise KeyError(bytes(header))
+
+
+def test_lexing_a_bad_prg_raises_the_lexer_error(tmp_path: Path) -> None:
+    path = tmp_path / "program"
+    path.write_bytes(make_prg((10, b"\x99 \xcb 10")))  # PRINT GO 10, GO can not be parsed
+
+    with pytest.raises(ValueError, match="GO"):
+        Lexer(TAGSET).detokenize_basic_file(path)
+
+
+def test_split_lines_warns_about_a_truncated_file() -> None:
+    data = make_prg((10, b"\x99 1"), (20, b"\x99 2"))[:-4]  # the terminator of line 20 is cut off
+
+    with pytest.warns(UserWarning, match="no EOL"):
+        linenos, _ = split_lines(data)
+    assert linenos.tolist() == [10]
@@ -0,0 +1,45 @@
+import pandas as pd
+
+from preprocessing.tokenized_corpus import NO_GAME, TokenizedCorpus
+
+
+def make_table(rows: list[tuple[int | None, int | None, str, int, str]]) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=["file_id", "game_id", "name", "line", "token"])
+    df["file_id"] = df["file_id"].astype("Int64")
+    df["game_id"] = df["game_id"].astype("Int64")
+    df["syntax"] = None
+    return df
+
+
+def test_rows_without_file_id_are_left_out() -> None:
+    df = make_table([
+        (None, None, "nometa", 10, "PRINT"),
+        (None, None, "nometa", 10, "a"),
+        (1, 7, "intro", 10, "GOTO"),
+        (1, 7, "intro", 10, "10"),
+        (2, None, "main", 5, "END"),
+    ])
+
+    corpus = TokenizedCorpus.from_dataframe(df)
+
+    assert corpus.file_offsets.tolist() == [0, 2, 3]
+    assert corpus.line_offsets.tolist() == [0, 2, 3]
+    assert corpus.statement_offsets.tolist() == [0, 2, 3]
+    assert corpus.statement_tokens() == [["GOTO", "10"], ["END"]]
+    assert corpus.file_ids.tolist() == [1, 2]
+    assert corpus.game_ids.tolist() == [7, NO_GAME]
+    assert corpus.names == ["intro", "main"]
+
+
+def test_statements_end_at_a_separator_or_the_line_end() -> None:
+    df = make_table([
+        (3, 1, "intro", 10, "PRINT"),
+        (3, 1, "intro", 10, ":"),
+        (3, 1, "intro", 10, "END"),
+        (3, 1, "intro", 20, "RUN"),
+    ])
+
+    corpus = TokenizedCorpus.from_dataframe(df)
+
+    assert corpus.statement_tokens() == [["PRINT", ":"], ["END"], ["RUN"]]
+    assert corpus.file_lines(0) == range(2)
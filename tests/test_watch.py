@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from preprocessing import watch
+from preprocessing.corpus import lex_file
+from preprocessing.dataset import NULL_PARTITION, partition_file, write_partition_file
+from preprocessing.vocabulary import Vocabulary
+
+
+PROGRAM = b"\x01\x08\x0b\x08\x0a\x00\x99 1\x00\x00\x00"  # 10 PRINT 1
+EMPTY_PROGRAM = b"\x01\x08\x00\x00"
+
+
+class StopWatching(Exception):
+    pass
+
+
+def write_program(path: Path, data: bytes) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, (0, 0))  # older than the settle time of the watcher
+    return path
+
+
+def test_empty_program_is_lexed_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    source_path = tmp_path / "encoded"
+    write_program(source_path / "disk" / "empty", EMPTY_PROGRAM)
+    write_program(source_path / "disk" / "intro", PROGRAM)
+    metadata_file = tmp_path / "metadata.xlsx"
+    pd.DataFrame({"name": ["intro"], "file_id": [1], "game_id": [1]}).to_excel(metadata_file, index=False)
+
+    lexed, polls = [], []
+
+    def lex_program(file: Path, cache: None = None) -> dict[str, list]:
+        lexed.append(file.name)
+        return lex_file(file)
+
+    def sleep(interval: float) -> None:
+        # stop after the second poll
+        polls.append(interval)
+        if len(polls) == 2:
+            raise StopWatching
+
+    monkeypatch.setattr(watch, "lex_program", lex_program)
+    monkeypatch.setattr(watch.time, "sleep", sleep)
+
+    with pytest.raises(StopWatching):
+        watch.watch(source_path, tmp_path / "tokens", metadata_file, tmp_path / "vocabulary.json", interval=0)
+
+    assert sorted(lexed) == ["empty", "intro"]
+    assert partition_file(tmp_path / "tokens", "disk", "intro", 1).is_file()
+
+
+def test_partition_cleanup_keeps_programs_of_other_disks(tmp_path: Path) -> None:
+    columns = lex_file(write_program(tmp_path / "encoded" / "intro", PROGRAM))
+    dataset_dir = tmp_path / "tokens"
+    vocabulary = Vocabulary()
+
+    # two programs of the same name without metadata
+    null_file = write_partition_file(dataset_dir, "disk1", columns, {}, vocabulary)
+    other_null_file = write_partition_file(dataset_dir, "disk2", columns, {}, vocabulary)
+    assert null_file.parent.parent.name == f"game_id={NULL_PARTITION}"
+    assert null_file != other_null_file
+
+    # the metadata of the program on disk1 is known now, only its copy in the null partition is replaced
+    game1_file = write_partition_file(dataset_dir, "disk1", columns, {"intro": (1, 1)}, vocabulary)
+    assert not null_file.exists()
+    assert other_null_file.is_file()
+
+    # the game_id of the program changed
+    game2_file = write_partition_file(dataset_dir, "disk1", columns, {"intro": (1, 2)}, vocabulary)
+    assert not game1_file.exists()
+    assert game2_file.is_file()
+    assert other_null_file.is_file()
+
+
+def test_empty_program_writes_no_file(tmp_path: Path) -> None:
+    columns = lex_file(write_program(tmp_path / "encoded" / "empty", EMPTY_PROGRAM))
+    assert write_partition_file(tmp_path / "tokens", "disk", columns, {}, Vocabulary()) is None